@@ -2,7 +2,12 @@ import argparse
 import cProfile
 import json
 from pathlib import Path
+from src.blocks import HTML_PARSERS
+from src.dataset_writer import OUTPUT_FORMATS
+from src.http_cache import HttpCache
+from src.image_codecs import CODECS
 from src.manager import Manager
+from src.rasterizer import RASTERIZERS
 
 
 def create_parser():
@@ -26,12 +31,76 @@ def create_parser():
                         help='Number of processes to use (default: 1)')
     parser.add_argument('--max_threads', type=int, default=3,
                         help='Maximum threads inside a process (default: 3)')
-    parser.add_argument('--ports', type=str, nargs='+', default=[8145, 8146],
-                        help='List of ports to use (default: [8145, 8146]). Number of ports \
-                            should be 2 times larger than num_processes')
+    parser.add_argument('--ports', type=str, nargs='+', default=['8145', '8146'],
+                        help='List of ports or port ranges like 4000-4007 to use (default: [8145, 8146]). Number of ports \
+                            should be 2 times larger than num_processes * unoservers_per_process')
+    parser.add_argument('--unoservers_per_process', type=int, default=1,
+                        help='Number of Unoserver instances in the converter pool of each process (default: 1)')
+    parser.add_argument('--recycle_after', type=int, default=0,
+                        help='Restart a Unoserver instance after this number of conversions, 0 to never restart (default: 0)')
+    parser.add_argument('--single_render', action='store_true',
+                        help='Render colored and clean pages with one docx to pdf conversion per document')
+    parser.add_argument('--max_retries', type=int, default=2,
+                        help='Number of retries of a url that failed to generate (default: 2)')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Start generating while the crawler is still discovering urls')
+    parser.add_argument('--queue_size', type=int, default=None,
+                        help='Maximum number of urls waiting in the work queue (default: 2 * num_processes * max_threads)')
+    parser.add_argument('--crawler_threads', type=int, default=8,
+                        help='Number of concurrent page fetchers of the url crawler (default: 8)')
+    parser.add_argument('--crawl_checkpoint', type=str, default=None,
+                        help='File to checkpoint the crawl to. An existing checkpoint is resumed (default: no checkpoint)')
+    parser.add_argument('--corpus', type=str, default=None,
+                        help='Generate from a local corpus instead of Wikipedia: a directory of .html files, \
+                            a .tar or .zip archive, or a .jsonl/.jsonl.gz shard made by scripts/pack_corpus.py')
+    parser.add_argument('--http_cache', type=str, default=None,
+                        help='SQLite file caching fetched pages, so repeated runs do not hit the network (default: no cache)')
+    parser.add_argument('--http_cache_size_mb', type=int, default=1024,
+                        help='Maximum size of the cached pages, least recently used pages are evicted (default: 1024)')
+    parser.add_argument('--revalidate', action='store_true',
+                        help='Revalidate cached pages with conditional requests instead of serving them as is')
+    parser.add_argument('--variants_per_url', type=int, default=1,
+                        help='Number of differently laid out documents generated from every parsed article (default: 1)')
+    parser.add_argument('--html_parser', type=str, default='lxml', choices=HTML_PARSERS,
+                        help='Parser extracting headings, paragraphs and tables from article HTML (default: lxml)')
+    parser.add_argument('--rasterizer', type=str, default='auto', choices=RASTERIZERS,
+                        help='PDF page renderer, auto uses pdfium when pypdfium2 is installed and poppler otherwise (default: auto)')
+    parser.add_argument('--pages_in_flight', type=int, default=0,
+                        help='Maximum number of pages being processed at once by the threads of a process (default: max_threads)')
+    parser.add_argument('--output_format', type=str, default='folder', choices=OUTPUT_FORMATS,
+                        help='Write every image and annotation as loose files, or pack them into WebDataset tar \
+                            or Parquet shards written directly by the processes (default: folder)')
+    parser.add_argument('--shard_size_mb', type=int, default=256,
+                        help='Target size of a tar or parquet shard (default: 256)')
+    parser.add_argument('--cpu_workers', type=int, default=0,
+                        help='Worker processes per generator for bbox extraction, augmentation and resizing, \
+                            0 to run them in the generator threads (default: 0)')
+    parser.add_argument('--codec', type=str, default='png', choices=CODECS,
+                        help='Image codec of the dataset, raw saves uint8 arrays as .npy (default: png)')
+    parser.add_argument('--quality', type=int, default=None,
+                        help='PNG compression level 0-9, or WebP and JPEG quality 0-100 (default: 6 for png, 90 for webp, 95 for jpeg)')
+    parser.add_argument('--writer_threads', type=int, default=2,
+                        help='Threads per generator encoding and writing images, so page threads never wait for them (default: 2)')
+    parser.add_argument('--metrics_interval', type=float, default=10,
+                        help='Seconds between the lines of stage timings and counters appended to out_dir/metrics.jsonl (default: 10)')
+    parser.add_argument('--metrics_port', type=int, default=0,
+                        help='Serve the metrics in the Prometheus text format at http://localhost:<port>/metrics, 0 to disable (default: 0)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue a run in out_dir: urls completed according to its manifest are skipped, failed ones are retried')
 
     return parser
 
+
+def parse_ports(values):
+    ports = []
+    for value in values:
+        if '-' in value:
+            start, end = value.split('-')
+            ports.extend(range(int(start), int(end) + 1))
+        else:
+            ports.append(int(value))
+    return tuple(ports)
+
 if __name__ == "__main__":
     parser = create_parser()
     args = parser.parse_args()
@@ -50,6 +119,29 @@ if __name__ == "__main__":
         max_urls=args.max_urls,
         num_processes=args.num_processes,
         max_threads=args.max_threads,
-        ports=tuple(args.ports)
+        ports=parse_ports(args.ports),
+        single_render=args.single_render,
+        unoservers_per_process=args.unoservers_per_process,
+        recycle_after=args.recycle_after,
+        max_retries=args.max_retries,
+        streaming=args.streaming,
+        queue_size=args.queue_size,
+        crawler_threads=args.crawler_threads,
+        crawl_checkpoint=args.crawl_checkpoint,
+        corpus=args.corpus,
+        http_cache=HttpCache(args.http_cache, args.http_cache_size_mb, args.revalidate) if args.http_cache else None,
+        variants_per_url=args.variants_per_url,
+        html_parser=args.html_parser,
+        rasterizer=args.rasterizer,
+        pages_in_flight=args.pages_in_flight,
+        output_format=args.output_format,
+        shard_size_mb=args.shard_size_mb,
+        resume=args.resume,
+        cpu_workers=args.cpu_workers,
+        codec=args.codec,
+        quality=args.quality,
+        writer_threads=args.writer_threads,
+        metrics_interval=args.metrics_interval,
+        metrics_port=args.metrics_port
     )
     manager.generate()
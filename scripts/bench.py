@@ -0,0 +1,251 @@
+"""Offline benchmark of every stage of the generation pipeline, with JSON output to catch regressions.
+
+Articles come from the bundled fixtures, synthetic MediaWiki pages of about 400, 2500 and
+10000 words in scripts/fixtures, or from any corpus accepted by main.py --corpus. Documents
+are converted by the stand-in of scripts/stand_in_converter, or by Unoserver with --ports.
+First the stages of every article are timed one by one in a single thread: parse, docx
+build, convert, rasterize, bbox extraction, augmentation, resize, encode and write. Then the whole
+pipeline runs for every combination of generator processes, threads and cpu workers.
+Run from the repository root:
+    python3 -m scripts.bench --out bench.json
+    python3 -m scripts.bench --out bench_new.json --compare bench.json
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import src.utils as utils
+from src.augmentations import augment
+from src.bbox_extraction import extract_bboxes
+from src.blocks import html_to_blocks
+from src.converter_pool import ConverterPool
+from src.dataset_writer import OUTPUT_FORMATS, open_writer, sample_key
+from src.document_generator import DocumentGenerator
+from src.image_codecs import CODECS, EXTENSIONS, encode_image, resize_image
+from src.ooxml_document import create_document
+from src.rasterizer import RASTERIZERS, get_rasterizer
+from src.sources import open_source
+from scripts.stand_in_converter import StandInConverter
+
+
+STAGES = ('parse', 'build', 'convert', 'rasterize', 'bbox', 'augment', 'resize', 'encode', 'write')
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--corpus', type=str, default='scripts/fixtures/bench_corpus.jsonl.gz')
+parser.add_argument('--ports', type=int, nargs='+', default=None,
+                    help='Convert with Unoserver instead of the stand-in, a port and a uno port for every process')
+parser.add_argument('-n', type=int, default=3, help='Number of runs of every article')
+parser.add_argument('--processes', type=int, nargs='+', default=[1])
+parser.add_argument('--threads', type=int, nargs='+', default=[1, 3])
+parser.add_argument('--cpu_workers', type=int, nargs='+', default=[0, 2])
+parser.add_argument('--rasterizer', type=str, default='auto', choices=RASTERIZERS)
+parser.add_argument('--output_format', type=str, default='folder', choices=OUTPUT_FORMATS)
+parser.add_argument('--codec', type=str, default='png', choices=CODECS)
+parser.add_argument('--quality', type=int, default=None)
+parser.add_argument('--out', type=str, default=None, help='JSON file to write the results to')
+parser.add_argument('--compare', type=str, default=None, help='JSON results of a previous version')
+parser.add_argument('--tolerance', type=float, default=0.2,
+                    help='Relative slowdown reported as a regression by --compare (default: 0.2)')
+args = parser.parse_args()
+
+with open('docx_config.json', 'r') as f:
+    docx_config = json.load(f)
+
+
+def converter_ports(process_id):
+    if args.ports is None:
+        return []
+    if len(args.ports) < 2 * (process_id + 1):
+        raise ValueError(f"{2 * max(args.processes)} ports are required, {len(args.ports)} given")
+    return [(args.ports[2 * process_id], args.ports[2 * process_id + 1])]
+
+
+def create_converter_pool(process_id):
+    if args.ports is None:
+        return ConverterPool([(None, None)], instance_factory=StandInConverter)
+    return ConverterPool(converter_ports(process_id))
+
+
+class StageTimer:
+    def __init__(self):
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+
+    @contextlib.contextmanager
+    def __call__(self, stage):
+        start_time = time.perf_counter()
+        yield
+        self.seconds[stage] += time.perf_counter() - start_time
+
+
+def time_stages(url, html, converter_pool, rasterizer, writer):
+    """Runs the pipeline of the generator threads on one article, timing every stage apart."""
+    timer = StageTimer()
+    with timer('parse'):
+        blocks = html_to_blocks(html, docx_config)
+    with timer('build'):
+        doc = create_document(docx_config, converter_pool, rasterizer)
+        doc.add_blocks(blocks)
+    with timer('convert'):
+        colored_pdf = doc._convert_to_pdf(doc._get_docx_bytes())
+        doc.convert_to_uncolored_docx()
+        clean_pdf = doc._convert_to_pdf(doc._get_docx_bytes())
+    with timer('rasterize'):
+        colored_images = list(rasterizer.iter_pages(colored_pdf, dpi=200, size=1500))
+        images = list(rasterizer.iter_pages(clean_pdf, dpi=200, size=1024))
+
+    for page_number, (colored_image, image) in enumerate(zip(colored_images, images)):
+        with timer('bbox'):
+            ids, bboxes = extract_bboxes(colored_image, len(doc.words))
+        colored_height, colored_width = colored_image.shape[:2]
+        bounding_boxes = utils.unnormalize_bboxes(bboxes, colored_width, colored_height)
+        with timer('augment'):
+            augmented_cv2, _, _, augmented_bounding_boxes = augment(np.array(image), bounding_boxes, page_number)
+        with timer('resize'):
+            final_image = resize_image(augmented_cv2, 244)
+        with timer('encode'):
+            data = encode_image(final_image, args.codec, args.quality)
+        augmented_bounding_boxes = np.array(augmented_bounding_boxes).astype(int)
+        annotation = {"words": [doc.words[i] for i in ids],
+                      "bboxes": utils.normalize_bboxes(augmented_bounding_boxes, colored_width, colored_height).tolist(),
+                      "seed": page_number}
+        with timer('write'):
+            writer.write(sample_key(url, 0, page_number), data, annotation)
+    return timer.seconds, len(doc.words), len(colored_images)
+
+
+def bench_stages(source, out_dir):
+    rasterizer = get_rasterizer(args.rasterizer)
+    converter_pool = create_converter_pool(0)
+    writer = open_writer(args.output_format, out_dir, 'bench', image_extension=EXTENSIONS[args.codec])
+    results = []
+    try:
+        for url in source.keys():
+            html = source.fetch(url)
+            runs = [time_stages(url, html, converter_pool, rasterizer, writer) for _ in range(args.n)]
+            seconds = {stage: statistics.median(run[0][stage] for run in runs) for stage in STAGES}
+            results.append({"article": url, "words": runs[0][1], "pages": runs[0][2], "seconds": seconds})
+            print(f'{url:32} {runs[0][1]:6} words {runs[0][2]:3} pages  ' +
+                  '  '.join(f'{stage} {seconds[stage] * 1000:.0f}' for stage in STAGES) + '  (ms)')
+    finally:
+        writer.close()
+        converter_pool.stop()
+    return results
+
+
+def generate_quietly(generator, url_queue, stats_queue):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        generator.generate(url_queue, stats_queue)
+
+
+def bench_pipeline(urls, num_processes, num_threads, cpu_workers, out_dir):
+    """Generates every url n times with the generators of a Manager, returns images and seconds."""
+    generators = []
+    for i in range(num_processes):
+        generator = DocumentGenerator(max_threads=num_threads, image_size=244, docx_config=docx_config,
+                                      out_folder=out_dir, ports=converter_ports(i), debug_mode=False,
+                                      corpus=args.corpus, rasterizer=args.rasterizer,
+                                      output_format=args.output_format, cpu_workers=cpu_workers,
+                                      codec=args.codec, quality=args.quality)
+        generator.converter_pool = create_converter_pool(i)
+        generators.append(generator)
+    url_queue = multiprocessing.Queue()
+    stats_queue = multiprocessing.Queue()
+    for _ in range(args.n):
+        for url in urls:
+            url_queue.put(url)
+    for _ in range(num_processes * num_threads):
+        url_queue.put(None)
+
+    start_time = time.perf_counter()
+    processes = [multiprocessing.Process(target=generate_quietly, args=(generator, url_queue, stats_queue))
+                 for generator in generators]
+    for process in processes:
+        process.start()
+    stats = [stats_queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start_time
+    return sum(process_stats["images"] for process_stats in stats), elapsed
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous):
+    """Prints the ratio to the previous results and returns the number of regressions."""
+    regressions = 0
+    previous_stages = {article["article"]: article["seconds"] for article in previous["stages"]}
+    for article in results["stages"]:
+        for stage, seconds in article["seconds"].items():
+            old = previous_stages.get(article["article"], {}).get(stage)
+            if not old:
+                continue
+            slower = seconds > old * (1 + args.tolerance)
+            regressions += slower
+            print(f'{article["article"]:32} {stage:10} {old * 1000:9.1f} -> {seconds * 1000:9.1f} ms'
+                  f'  {seconds / old:5.2f}x{"  REGRESSION" if slower else ""}')
+    previous_runs = {(run["processes"], run["threads"], run["cpu_workers"]): run for run in previous["pipeline"]}
+    for run in results["pipeline"]:
+        old = previous_runs.get((run["processes"], run["threads"], run["cpu_workers"]))
+        if old is None or not old["images_per_second"]:
+            continue
+        slower = run["images_per_second"] < old["images_per_second"] / (1 + args.tolerance)
+        regressions += slower
+        print(f'pipeline {run["processes"]}p {run["threads"]}t {run["cpu_workers"]}w '
+              f'{old["images_per_second"]:7.2f} -> {run["images_per_second"]:7.2f} images/s'
+              f'{"  REGRESSION" if slower else ""}')
+    return regressions
+
+
+if __name__ == '__main__':
+    source = open_source(args.corpus)
+    results = {"commit": git_commit(),
+               "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+               "python": platform.python_version(),
+               "cpu_count": os.cpu_count(),
+               "converter": "unoserver" if args.ports else "stand-in",
+               "config": vars(args),
+               "stages": [],
+               "pipeline": []}
+
+    print('Stages, single thread, median of', args.n, 'runs:')
+    with tempfile.TemporaryDirectory() as out_dir:
+        results["stages"] = bench_stages(source, Path(out_dir))
+
+    print('Pipeline:')
+    for num_processes in args.processes:
+        for num_threads in args.threads:
+            for cpu_workers in args.cpu_workers:
+                with tempfile.TemporaryDirectory() as out_dir:
+                    images, elapsed = bench_pipeline(source.keys(), num_processes, num_threads, cpu_workers, Path(out_dir))
+                results["pipeline"].append({"processes": num_processes, "threads": num_threads,
+                                            "cpu_workers": cpu_workers, "images": images, "seconds": elapsed,
+                                            "images_per_second": images / elapsed})
+                print(f'{num_processes} processes, {num_threads} threads, {cpu_workers} cpu workers: '
+                      f'{images} images in {elapsed:.2f} s, {images / elapsed:.2f} images/s')
+
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            previous = json.load(f)
+        print(f'Compared to {previous["commit"]}:')
+        if compare(results, previous):
+            sys.exit(1)
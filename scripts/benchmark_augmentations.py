@@ -0,0 +1,51 @@
+"""Compares per-page augmentation latency of a fresh pipeline per page and a reused pipeline.
+
+Run from the repository root:
+    python3 -m scripts.benchmark_augmentations -n 20
+"""
+import argparse
+import time
+
+from augraphy import AugraphyPipeline
+import numpy as np
+
+from src.augmentations import augment, get_augmentation_phases
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', type=int, default=20)
+parser.add_argument('--image_size', type=int, default=1024)
+args = parser.parse_args()
+
+# a white page with rows of dark word-sized rectangles
+rng = np.random.default_rng(0)
+image = np.full((args.image_size, args.image_size, 3), 255, dtype=np.uint8)
+bounding_boxes = []
+for y in range(40, args.image_size - 40, 30):
+    x = 40
+    while x < args.image_size - 120:
+        width = int(rng.integers(20, 80))
+        image[y:y + 16, x:x + width] = 0
+        bounding_boxes.append([x, y, x + width, y + 16])
+        x += width + 10
+
+
+def rebuild_per_page():
+    pipeline = AugraphyPipeline(bounding_boxes=bounding_boxes, log=False, **get_augmentation_phases())
+    pipeline(image.copy())
+
+
+def reuse_per_thread(seed):
+    augment(image.copy(), bounding_boxes, seed)
+
+
+results = {}
+for name, run in (('rebuild per page', lambda i: rebuild_per_page()), ('reuse per thread', reuse_per_thread)):
+    run(0)  # warm up imports and the thread pipeline
+    start_time = time.perf_counter()
+    for i in range(args.n):
+        run(i)
+    results[name] = (time.perf_counter() - start_time) / args.n
+    print(f'{name}: {results[name] * 1000:.1f} ms per page')
+
+print(f"Speedup: {results['rebuild per page'] / results['reuse per thread']:.2f}x")
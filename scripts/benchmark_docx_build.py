@@ -0,0 +1,71 @@
+"""Measures document building, saving and uncolored saving time of every writer against the number of words, up to the max_words cap.
+
+Documents are built from synthetic blocks shaped like a Wikipedia article: paragraphs of
+80 words with bold and italic runs, a heading every 10 paragraphs and a small table every 20.
+Run from the repository root:
+    python3 -m scripts.benchmark_docx_build -n 3 --writers python-docx ooxml
+"""
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+from src.blocks import BlockBuilder
+from src.ooxml_document import WRITERS
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--words', type=int, nargs='+', default=[1000, 2500, 5000, 10000, 20000])
+parser.add_argument('-n', type=int, default=3, help='Number of documents built per size')
+parser.add_argument('--writers', type=str, nargs='+', default=list(WRITERS), choices=list(WRITERS))
+args = parser.parse_args()
+
+with open('docx_config.json', 'r') as f:
+    docx_config = json.load(f)
+
+
+def make_blocks(num_words):
+    rng = random.Random(0)
+    vocabulary = ['lorem', 'ipsum', 'dolor', 'sit', 'amet,', 'consectetur', 'adipiscing', 'elit.', '(sed', 'do)']
+    builder = BlockBuilder(dict(docx_config, max_words=num_words - 1))
+    i = 0
+    while not builder.is_full():
+        if i % 10 == 0:
+            builder.add_heading(2, f'Section {i // 10}')
+        if i % 20 == 5:
+            builder.add_table([[rng.choice(vocabulary) for _ in range(3)] for _ in range(4)])
+        runs = []
+        for _ in range(16):
+            text = ' '.join(rng.choice(vocabulary) for _ in range(5))
+            runs.append((f' {text} ', rng.choice([None, None, None, 'b', 'i'])))
+        builder.add_paragraph(runs)
+        i += 1
+    return builder.blocks
+
+
+for writer in args.writers:
+    # the process wide template of the ooxml writer is not part of the measurement
+    WRITERS[writer](docx_config, None)
+    np.random.seed(0)
+    for num_words in args.words:
+        blocks = make_blocks(num_words)
+        build_time = save_time = uncolor_time = 0
+        for _ in range(args.n):
+            start_time = time.perf_counter()
+            doc = WRITERS[writer](docx_config, None)
+            doc.add_blocks(blocks)
+            build_time += time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            doc._get_docx_bytes()
+            save_time += time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            doc.convert_to_uncolored_docx()
+            doc._get_docx_bytes()
+            uncolor_time += time.perf_counter() - start_time
+        print(f'{writer:12} {doc.get_num_words():6} words: build {build_time / args.n * 1000:8.1f} ms, '
+              f'save {save_time / args.n * 1000:7.1f} ms, uncolor and save {uncolor_time / args.n * 1000:7.1f} ms, '
+              f'{(build_time + save_time) / args.n / doc.get_num_words() * 1e6:5.1f} us per word')
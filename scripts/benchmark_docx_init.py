@@ -0,0 +1,41 @@
+"""Measures DocxDocument construction time with cold and warm font/palette caches.
+
+Cold construction repeats the work every document did before the caches existed.
+Run from the repository root:
+    python3 -m scripts.benchmark_docx_init -n 20
+"""
+import argparse
+import json
+import time
+
+from src import docx_resources
+from src.docx_document import DocxDocument
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', type=int, default=20)
+args = parser.parse_args()
+
+with open('docx_config.json', 'r') as f:
+    docx_config = json.load(f)
+
+
+def construct(cold):
+    start_time = time.perf_counter()
+    for _ in range(args.n):
+        if cold:
+            docx_resources.clear_caches(disk=True)
+        DocxDocument(docx_config, None)
+    return (time.perf_counter() - start_time) / args.n
+
+
+cold = construct(cold=True)
+docx_resources.clear_caches()
+start_time = time.perf_counter()
+docx_resources.get_available_fonts()
+disk = time.perf_counter() - start_time
+warm = construct(cold=False)
+
+print(f'Before (no caches):      {cold * 1000:.2f} ms per document')
+print(f'Font list from disk:     {disk * 1000:.2f} ms per process')
+print(f'After (process caches):  {warm * 1000:.2f} ms per document ({cold / warm:.1f}x)')
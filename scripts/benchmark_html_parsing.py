@@ -0,0 +1,42 @@
+"""Compares the HTML parsers of html_to_blocks on a fixed local set of saved pages.
+
+The pages are the bundled fixture articles, or any corpus accepted by --corpus, for example a shard
+packed with scripts.pack_corpus. Every page is parsed by every parser, and the blocks are checked to
+be equal. Run from the repository root:
+    python3 -m scripts.benchmark_html_parsing -n 3
+"""
+import argparse
+import json
+import time
+
+from src.blocks import HTML_PARSERS, html_to_blocks
+from src.sources import open_source
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--corpus', type=str, default='scripts/fixtures/bench_corpus.jsonl.gz')
+parser.add_argument('--max_pages', type=int, default=100)
+parser.add_argument('-n', type=int, default=3, help='Number of passes over the pages')
+args = parser.parse_args()
+
+with open('docx_config.json', 'r') as f:
+    docx_config = json.load(f)
+
+source = open_source(args.corpus)
+pages = [source.fetch(key) for key in source.keys()[:args.max_pages]]
+pages = [html for html in pages if html is not None]
+print(f'{len(pages)} pages, {sum(len(html) for html in pages) / len(pages) / 1024:.0f} KiB on average')
+
+times = {}
+blocks = {}
+for html_parser in HTML_PARSERS:
+    start_time = time.perf_counter()
+    for _ in range(args.n):
+        blocks[html_parser] = [html_to_blocks(html, docx_config, html_parser) for html in pages]
+    times[html_parser] = (time.perf_counter() - start_time) / args.n / len(pages)
+
+baseline = times['html.parser']
+for html_parser in HTML_PARSERS:
+    mismatches = sum(a != b for a, b in zip(blocks[html_parser], blocks['html.parser']))
+    print(f'{html_parser:12} {times[html_parser] * 1000:8.2f} ms per page ({baseline / times[html_parser]:.1f}x), '
+          f'{mismatches} pages differ from html.parser')
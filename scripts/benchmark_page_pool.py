@@ -0,0 +1,66 @@
+"""Measures the speedup of the CPU page stages in a process pool over running them in threads.
+
+Every stage after rendering runs on synthetic pages: bbox extraction from a colored
+page of word rectangles, augmentation of the clean page and resizing.
+The threads baseline is the previous pipeline, the pool is measured for every number
+of worker processes, fed by at least as many threads as there are workers.
+Run from the repository root:
+    python3 -m scripts.benchmark_page_pool -n 48 --workers 1 2 4 8
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+
+import numpy as np
+
+from src.page_pool import PagePool, process_page
+from src.palette import ids_to_rgb
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', type=int, default=48, help='Number of pages per measurement')
+parser.add_argument('--threads', type=int, default=3)
+parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, 2, 4, os.cpu_count()}))
+args = parser.parse_args()
+
+# a colored page of word-sized rectangles and a clean page of the same words
+rng = np.random.default_rng(0)
+colored_image = np.full((1500, 1160, 3), 255, dtype=np.uint8)
+image = np.full((1024, 792, 3), 255, dtype=np.uint8)
+boxes = []
+for y in range(60, 1440, 30):
+    x = 60
+    while x < 1000:
+        width = int(rng.integers(20, 80))
+        boxes.append((x, y, width))
+        x += width + 10
+colors = ids_to_rgb(np.arange(len(boxes)))
+for i, (x, y, width) in enumerate(boxes):
+    colored_image[y:y + 16, x:x + width] = colors[i]
+    image[y * 1024 // 1500:(y + 16) * 1024 // 1500, x * 1024 // 1500:(x + width) * 1024 // 1500] = 0
+num_words = len(boxes)
+
+
+def measure(run_page, num_threads):
+    run_page(0)  # warm up imports, pipelines and worker processes
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(num_threads) as executor:
+        results = list(executor.map(run_page, range(1, args.n + 1)))
+    elapsed = time.perf_counter() - start_time
+    assert all(len(ids) == len(bboxes) for ids, bboxes, _, _, _ in results)
+    return args.n / elapsed
+
+
+baseline = measure(lambda seed: process_page(colored_image, image, num_words, seed, 244), args.threads)
+print(f'{"threads only":16} {baseline:7.2f} pages/s')
+for num_workers in args.workers:
+    num_threads = max(args.threads, num_workers)
+    pool = PagePool(num_workers, num_threads, colored_image.nbytes + image.nbytes)
+    pool.start()
+    try:
+        throughput = measure(lambda seed: pool.run(process_page, (colored_image, image), num_words, seed, 244),
+                             num_threads)
+    finally:
+        pool.stop()
+    print(f'{f"{num_workers} workers":16} {throughput:7.2f} pages/s, speedup {throughput / baseline:.2f}x')
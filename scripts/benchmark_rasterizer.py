@@ -0,0 +1,87 @@
+"""Compares time and peak memory of the pdf rasterizers on a multi-page pdf.
+
+The eager baseline is the previous pipeline, which decoded all pages with pdf2image at once.
+Without --pdf, a synthetic pdf with palette colored word boxes is drawn with matplotlib, and
+the words recovered from every rendered page are checked.
+Run from the repository root:
+    python3 -m scripts.benchmark_rasterizer --pages 20
+"""
+import argparse
+import io
+import time
+import tracemalloc
+
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.backends.backend_pdf import PdfPages
+import matplotlib.pyplot as plt
+from matplotlib.patches import Rectangle
+import numpy as np
+from pdf2image import convert_from_bytes
+
+from src.bbox_extraction import extract_bboxes
+from src.palette import ids_to_rgb
+from src.rasterizer import PopplerRasterizer, get_rasterizer
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--pdf', type=str, default=None)
+parser.add_argument('--pages', type=int, default=20)
+parser.add_argument('--size', type=int, default=1500)
+args = parser.parse_args()
+
+WORDS_PER_PAGE = 300
+
+
+def make_pdf(num_pages):
+    out = io.BytesIO()
+    colors = ids_to_rgb(np.arange(num_pages * WORDS_PER_PAGE)) / 255
+    with PdfPages(out) as pdf:
+        for page in range(num_pages):
+            figure = plt.figure(figsize=(8.5, 11))
+            axes = figure.add_axes((0, 0, 1, 1))
+            axes.set_axis_off()
+            for i in range(WORDS_PER_PAGE):
+                x, y = 0.05 + (i % 10) * 0.09, 0.95 - (i // 10) * 0.03
+                axes.add_patch(Rectangle((x, y), 0.07, 0.015, color=colors[page * WORDS_PER_PAGE + i], linewidth=0))
+            pdf.savefig(figure)
+            plt.close(figure)
+    return out.getvalue()
+
+
+def consume(pages, num_words):
+    found = 0
+    for page in pages:
+        found += len(extract_bboxes(page, num_words)[0])
+    return found
+
+
+if args.pdf is not None:
+    with open(args.pdf, 'rb') as f:
+        pdf_bytes = f.read()
+else:
+    pdf_bytes = make_pdf(args.pages)
+num_words = args.pages * WORDS_PER_PAGE
+
+runs = {'poppler, eager (before)': lambda: [np.asarray(image) for image in convert_from_bytes(pdf_bytes, dpi=200, size=args.size)],
+        'poppler, lazy': lambda: PopplerRasterizer().iter_pages(pdf_bytes, dpi=200, size=args.size)}
+try:
+    pdfium_rasterizer = get_rasterizer('pdfium')
+    runs['pdfium, lazy'] = lambda: pdfium_rasterizer.iter_pages(pdf_bytes, dpi=200, size=args.size)
+except ImportError:
+    print('pypdfium2 is not installed')
+
+for name, render in runs.items():
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    try:
+        found = consume(render(), num_words)
+    except Exception as e:
+        print(f'{name:24} failed: {e}')
+        tracemalloc.stop()
+        continue
+    elapsed = time.perf_counter() - start_time
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    check = '' if args.pdf is not None else f', {found}/{num_words} words found'
+    print(f'{name:24} {elapsed * 1000:8.1f} ms, peak {peak / 2 ** 20:7.1f} MiB{check}')
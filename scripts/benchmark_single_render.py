@@ -0,0 +1,56 @@
+"""Compares seconds per url of the two-pass and the single-render pipelines.
+
+Articles come from the bundled fixtures, or from any corpus accepted by main.py --corpus.
+Documents are converted by the stand-in of scripts/stand_in_converter, or by Unoserver with --ports.
+Both modes draw the same layouts and augmentations, so they only differ in the conversions.
+Run from the repository root:
+    python3 -m scripts.benchmark_single_render
+    python3 -m scripts.benchmark_single_render --ports 4000 4001
+"""
+import argparse
+import json
+from pathlib import Path
+import queue
+import random
+import tempfile
+
+from src.converter_pool import ConverterPool
+from src.document_generator import DocumentGenerator
+from src.sources import open_source
+from scripts.stand_in_converter import StandInConverter
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--corpus', type=str, default='scripts/fixtures/bench_corpus.jsonl.gz')
+parser.add_argument('--max_urls', type=int, default=8)
+parser.add_argument('--ports', type=int, nargs=2, default=None,
+                    help='Convert with Unoserver instead of the stand-in, a port and a uno port')
+args = parser.parse_args()
+
+with open('docx_config.json', 'r') as f:
+    docx_config = json.load(f)
+
+urls = open_source(args.corpus).keys()[:args.max_urls]
+
+results = {}
+for single_render in (False, True):
+    with tempfile.TemporaryDirectory() as out_folder:
+        ports = [] if args.ports is None else [tuple(args.ports)]
+        generator = DocumentGenerator(max_threads=1, image_size=244, docx_config=docx_config,
+                                      out_folder=Path(out_folder), ports=ports, debug_mode=False,
+                                      single_render=single_render, corpus=args.corpus)
+        if args.ports is None:
+            generator.converter_pool = ConverterPool([(None, None)], instance_factory=StandInConverter)
+        # the single thread draws the layout and page seeds in the same order in both modes
+        generator.seed_generator = random.Random(0)
+        url_queue = queue.Queue()
+        for url in urls + [None]:
+            url_queue.put(url)
+        generator.generate(url_queue)
+        counters = generator.metrics.snapshot()["counters"]
+        results[single_render] = counters["busy_time"] / len(urls), generator.image_counter
+
+for single_render, (seconds_per_url, images) in results.items():
+    print(f'single_render={single_render}: {seconds_per_url:.3f} seconds per url, {images} images')
+print(f'Saving: {results[False][0] - results[True][0]:.3f} seconds per url '
+      f'({results[False][0] / results[True][0]:.2f}x)')
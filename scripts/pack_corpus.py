@@ -0,0 +1,53 @@
+"""Crawls Wikipedia once and packs the article HTML into a JSONL shard for offline generation.
+
+Run from the repository root:
+    python3 -m scripts.pack_corpus --max_urls 1000 --out corpus.jsonl.gz
+    python3 main.py --out_dir data --corpus corpus.jsonl.gz
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import json
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.url_parser import UrlParser
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--out', type=str, required=True,
+                    help='Output shard, gzip compressed if the name ends with .gz')
+parser.add_argument('--start_page', type=str, default='https://en.wikipedia.org/wiki/Main_Page')
+parser.add_argument('--languages', type=str, nargs='+', default=['en'])
+parser.add_argument('--max_urls', type=int, default=100)
+parser.add_argument('--threads', type=int, default=8)
+args = parser.parse_args()
+
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=args.threads, pool_maxsize=args.threads)
+session.mount('http://', adapter)
+session.mount('https://', adapter)
+
+
+def fetch(url):
+    try:
+        response = session.get(url, timeout=30)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to retrieve {url}: {e}")
+        return url, None
+    return url, response.text
+
+
+urls = UrlParser(num_fetchers=args.threads).iter_urls(args.start_page, args.max_urls, tuple(args.languages))
+open_shard = gzip.open if args.out.endswith('.gz') else open
+packed = 0
+with open_shard(args.out, 'wt', encoding='utf-8') as f, ThreadPoolExecutor(max_workers=args.threads) as executor:
+    for url, html in executor.map(fetch, urls):
+        if html is not None:
+            # the url goes first, readers index the shard by parsing only this prefix
+            f.write(json.dumps({"url": url, "html": html}, ensure_ascii=False) + '\n')
+            packed += 1
+
+print(f'Packed {packed} articles into {args.out}')
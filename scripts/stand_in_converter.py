@@ -0,0 +1,99 @@
+"""A local stand-in for Unoserver, so the generation pipeline can be benchmarked without LibreOffice.
+
+Paragraphs of word/document.xml are laid out on letter pages with a fixed font metric,
+and every word run becomes a rectangle filled with its shading, or its text color when
+it is not shaded. The colored pages decode to the same word ids as a real conversion,
+the clean pages are black boxes. Layout time is not LibreOffice's, so the convert stage
+of a benchmark with the stand-in only measures the docx serialization around it.
+"""
+import io
+import zipfile
+
+from lxml import etree
+
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+PAGE_WIDTH, PAGE_HEIGHT, MARGIN = 612, 792, 72
+LINE_HEIGHT, WORD_HEIGHT, CHAR_WIDTH, SPACE_WIDTH = 14, 9, 5, 3
+
+
+def docx_to_pdf(docx_bytes):
+    with zipfile.ZipFile(io.BytesIO(docx_bytes)) as package:
+        body = etree.fromstring(package.read('word/document.xml')).find(f'{W}body')
+    pages = [[]]
+    x, y = MARGIN, PAGE_HEIGHT - MARGIN
+    for paragraph in body.iter(f'{W}p'):
+        for run in paragraph.iter(f'{W}r'):
+            text = ''.join(run.itertext())
+            width = CHAR_WIDTH * len(text) if text.strip() else SPACE_WIDTH
+            if x + width > PAGE_WIDTH - MARGIN:
+                x, y = MARGIN, y - LINE_HEIGHT
+            if y < MARGIN:
+                pages.append([])
+                x, y = MARGIN, PAGE_HEIGHT - MARGIN
+            color = _run_color(run)
+            if text.strip() and color is not None:
+                pages[-1].append((color, x, y, width))
+            x += width
+        x, y = MARGIN, y - LINE_HEIGHT
+        # the section break of a single render starts the clean half on a new page
+        if paragraph.find(f'{W}pPr/{W}sectPr') is not None:
+            pages.append([])
+            y = PAGE_HEIGHT - MARGIN
+    return _write_pdf(pages)
+
+
+def _run_color(run):
+    shading = run.find(f'{W}rPr/{W}shd')
+    fill = shading.get(f'{W}fill', '').lstrip('#') if shading is not None else ''
+    if fill and fill not in ('auto', 'FFFFFF'):
+        return fill
+    color = run.find(f'{W}rPr/{W}color')
+    return color.get(f'{W}val') if color is not None else '000000'
+
+
+def _write_pdf(pages):
+    objects = ['<</Type/Catalog/Pages 2 0 R>>', None]
+    kids = []
+    for rectangles in pages:
+        content = ''.join(f'{int(color[:2], 16) / 255:.4f} {int(color[2:4], 16) / 255:.4f} '
+                          f'{int(color[4:], 16) / 255:.4f} rg {x} {y} {width} {WORD_HEIGHT} re f\n'
+                          for color, x, y, width in rectangles)
+        objects.append(f'<</Length {len(content)}>>\nstream\n{content}endstream')
+        objects.append(f'<</Type/Page/Parent 2 0 R/MediaBox[0 0 {PAGE_WIDTH} {PAGE_HEIGHT}]/Contents {len(objects)} 0 R>>')
+        kids.append(f'{len(objects)} 0 R')
+    objects[1] = f'<</Type/Pages/Kids[{" ".join(kids)}]/Count {len(kids)}>>'
+
+    out = io.BytesIO()
+    out.write(b'%PDF-1.4\n')
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f'{number} 0 obj\n{obj}\nendobj\n'.encode('ascii'))
+    xref = out.tell()
+    out.write(f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode('ascii'))
+    out.write(''.join(f'{offset:010d} 00000 n \n' for offset in offsets).encode('ascii'))
+    out.write(f'trailer\n<</Size {len(objects) + 1}/Root 1 0 R>>\nstartxref\n{xref}\n%%EOF\n'.encode('ascii'))
+    return out.getvalue()
+
+
+class StandInConverter:
+    """Converter instance of a ConverterPool, see ConverterPool.instance_factory."""
+
+    def __init__(self, port=None, uno_port=None):
+        self.port = port
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def is_alive(self):
+        return True
+
+    def is_ready(self):
+        return True
+
+    def convert(self, indata, convert_to):
+        return docx_to_pdf(indata)
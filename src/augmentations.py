@@ -1,5 +1,38 @@
 import random
+import threading
 from augraphy import * 
+import cv2
+import numpy as np
+
+
+_thread_local = threading.local()
+
+# parameters that augmentations take as single values, drawn when they are constructed,
+# are drawn again for every page, so the reused pipelines of the threads keep their variety
+PAGE_DRAWS = {
+    Dithering: {"dither": lambda rng: rng.choice(["ordered", "floyd-steinberg"])},
+    InkBleed: {"kernel_size": lambda rng: rng.choice([(7, 7), (5, 5), (3, 3)])},
+    BleedThrough: {"alpha": lambda rng: rng.uniform(0.1, 0.2)},
+    LowInkRandomLines: {"use_consistent_lines": lambda rng: rng.choice([True, False])},
+    LowInkPeriodicLines: {"use_consistent_lines": lambda rng: rng.choice([True, False])},
+    PatternGenerator: {"imgx": lambda rng: rng.randint(256, 512),
+                       "imgy": lambda rng: rng.randint(256, 512)},
+    DirtyDrum: {"line_concentration": lambda rng: rng.uniform(0.05, 0.15),
+                "direction": lambda rng: rng.randint(0, 2),
+                "noise_intensity": lambda rng: rng.uniform(0.6, 0.95),
+                "ksize": lambda rng: rng.choice([(3, 3), (5, 5), (7, 7)])},
+    SubtleNoise: {"subtle_range": lambda rng: rng.randint(5, 10)},
+    Markup: {"markup_type": lambda rng: rng.choice(["strikethrough", "crossed", "highlight", "underline"])},
+    Faxify: {"monochrome": lambda rng: rng.choice([0, 1]),
+             "halftone": lambda rng: rng.choice([0, 1]),
+             "half_kernel_size": lambda rng: rng.choice([(1, 1), (2, 2)])},
+    PageBorder: {"same_page_border": lambda rng: rng.choice([0, 1])},
+    Folding: {"fold_count": lambda rng: rng.randint(2, 8)},
+}
+
+
+def _first_draw(augmentation_class):
+    return {attribute: draw(random) for attribute, draw in PAGE_DRAWS[augmentation_class].items()}
 
 
 def get_augmentation_phases():
@@ -35,12 +68,12 @@ def get_augmentation_phases():
         OneOf(
             [
                 Dithering(
-                    dither=random.choice(["ordered", "floyd-steinberg"]),
+                    **_first_draw(Dithering),
                     order=(3, 5),
                 ),
                 InkBleed(
                     intensity_range=(0.1, 0.2),
-                    kernel_size=random.choice([(7, 7), (5, 5), (3, 3)]),
+                    **_first_draw(InkBleed),
                     severity=(0.4, 0.6),
                 ),
             ],
@@ -61,7 +94,7 @@ def get_augmentation_phases():
                     color_range=(32, 224),
                     ksize=(17, 17),
                     sigmaX=1,
-                    alpha=random.uniform(0.1, 0.2),
+                    **_first_draw(BleedThrough),
                     offsets=(10, 20),
                 ),
             ],
@@ -94,13 +127,13 @@ def get_augmentation_phases():
             [
                 LowInkRandomLines(
                     count_range=(5, 10),
-                    use_consistent_lines=random.choice([True, False]),
+                    **_first_draw(LowInkRandomLines),
                     noise_probability=0.1,
                 ),
                 LowInkPeriodicLines(
                     count_range=(2, 5),
                     period_range=(16, 32),
-                    use_consistent_lines=random.choice([True, False]),
+                    **_first_draw(LowInkPeriodicLines),
                     noise_probability=0.1,
                 ),
             ],
@@ -126,8 +159,7 @@ def get_augmentation_phases():
                 #    color_list_alternate="default",
                 #),
                 PatternGenerator(
-                    imgx=random.randint(256, 512),
-                    imgy=random.randint(256, 512),
+                    **_first_draw(PatternGenerator),
                     n_rotation_range=(10, 15),
                     color="random",
                     alpha_range=(0.25, 0.5),
@@ -200,11 +232,8 @@ def get_augmentation_phases():
             [
                 DirtyDrum(
                     line_width_range=(1, 6),
-                    line_concentration=random.uniform(0.05, 0.15),
-                    direction=random.randint(0, 2),
-                    noise_intensity=random.uniform(0.6, 0.95),
+                    **_first_draw(DirtyDrum),
                     noise_value=(64, 224),
-                    ksize=random.choice([(3, 3), (5, 5), (7, 7)]),
                     sigmaX=0,
                     p=0.1,
                 ),
@@ -240,7 +269,7 @@ def get_augmentation_phases():
         OneOf(
             [
                 SubtleNoise(
-                    subtle_range=random.randint(5, 10),
+                    **_first_draw(SubtleNoise),
                 ),
                 Jpeg(
                     quality_range=(25, 95),
@@ -254,7 +283,7 @@ def get_augmentation_phases():
                     num_lines_range=(2, 7),
                     markup_length_range=(0.5, 1),
                     markup_thickness_range=(1, 2),
-                    markup_type=random.choice(["strikethrough", "crossed", "highlight", "underline"]),
+                    **_first_draw(Markup),
                     markup_color="random",
                     single_word_mode=False,
                     repetitions=1,
@@ -381,12 +410,10 @@ def get_augmentation_phases():
                 ),
                 Faxify(
                     scale_range=(0.3, 0.6),
-                    monochrome=random.choice([0, 1]),
+                    **_first_draw(Faxify),
                     monochrome_method="random",
                     monochrome_arguments={},
-                    halftone=random.choice([0, 1]),
                     invert=1,
-                    half_kernel_size=random.choice([(1, 1), (2, 2)]),
                     angle=(0, 360),
                     sigma=(1, 3),
                 ),
@@ -427,7 +454,7 @@ def get_augmentation_phases():
                     curve_frequency=(2, 8),
                     curve_height=(2, 4),
                     curve_length_one_side=(50, 100),
-                    same_page_border=random.choice([0, 1]),
+                    **_first_draw(PageBorder),
                 ),
                 #BookBinding(
                 #    shadow_radius_range=(30, 100),
@@ -445,7 +472,7 @@ def get_augmentation_phases():
                 Folding(
                     fold_x=None,
                     fold_deviation=(0, 0),
-                    fold_count=random.randint(2, 8),
+                    **_first_draw(Folding),
                     fold_noise=0.01,
                     fold_angle_range=(-360, 360),
                     gradient_width=(0.1, 0.2),
@@ -461,3 +488,42 @@ def get_augmentation_phases():
             'paper_phase': paper_phase, 
             'post_phase': post_phase, 
             'pre_phase': pre_phase}
+
+
+def _iter_augmentations(augmentations):
+    for augmentation in augmentations:
+        yield augmentation
+        yield from _iter_augmentations(getattr(augmentation, 'augmentations', []))
+
+
+def get_augmentation_pipeline():
+    """Returns the AugraphyPipeline of the current thread and its augmentations in PAGE_DRAWS, built on the first call."""
+    pipeline = getattr(_thread_local, 'pipeline', None)
+    if pipeline is None:
+        phases = get_augmentation_phases()
+        pipeline = AugraphyPipeline(log=False, **phases)
+        drawn = [augmentation for phase in phases.values() for augmentation in _iter_augmentations(phase)
+                 if type(augmentation) in PAGE_DRAWS]
+        _thread_local.pipeline = pipeline, drawn
+    return _thread_local.pipeline
+
+
+def augment(image, bounding_boxes, seed):
+    """Augments a page with the pipeline of the current thread.
+
+    The parameters of PAGE_DRAWS are drawn from seed, and the global random generators
+    are reseeded with it for the draws made during the call. Threads share the global
+    generators, so seed reproduces a page exactly where pages are augmented one at a
+    time, as in the processes of --cpu_workers.
+    """
+    pipeline, drawn = get_augmentation_pipeline()
+    rng = random.Random(seed)
+    for augmentation in drawn:
+        for attribute, draw in PAGE_DRAWS[type(augmentation)].items():
+            setattr(augmentation, attribute, draw(rng))
+    random.seed(seed)
+    np.random.seed(seed)
+    cv2.setRNGSeed(seed)
+
+    pipeline.bounding_boxes = bounding_boxes
+    return pipeline(image)
@@ -0,0 +1,51 @@
+import numpy as np
+
+from src.palette import codes_to_ids, pack_rgb
+
+
+def extract_bboxes(image, num_words, min_pixels=4):
+    """Finds the bounding box of every colored word on a page in a single pass.
+
+    Returns an array of word ids, in ascending order, and an (N, 4) array of
+    x1, y1, x2, y2 boxes normalized to [0, 1].
+    """
+    pixels = pack_rgb(image)
+    height, width = pixels.shape
+
+    # keep pixels that share the color of their right and bottom neighbours, so the
+    # antialiased edges of the rectangles never produce colors of other words
+    inner = pixels[:-1, :-1]
+    solid = (inner == pixels[:-1, 1:]) & (inner == pixels[1:, :-1]) & (inner != 0xFFFFFF)
+    values = np.where(solid, inner, -1)
+
+    # split every row into horizontal runs of one color, a word covers a few runs per row
+    changes = np.ones((values.shape[0], values.shape[1] + 1), dtype=bool)
+    changes[:, 1:-1] = values[:, 1:] != values[:, :-1]
+    run_starts = np.flatnonzero(changes[:, :-1] & solid)
+    run_ends = np.flatnonzero(changes[:, 1:] & solid)
+    run_ys, run_x1 = np.divmod(run_starts, values.shape[1])
+    run_x2 = run_ends % values.shape[1]
+    ids = codes_to_ids(values.ravel()[run_starts])
+    matched = (ids >= 0) & (ids < num_words)
+    ids, run_ys, run_x1, run_x2 = ids[matched], run_ys[matched], run_x1[matched], run_x2[matched]
+    if len(ids) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 4))
+
+    order = np.argsort(ids, kind='stable')
+    ids, ys, x1, x2 = ids[order], run_ys[order], run_x1[order], run_x2[order]
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    ends = np.r_[starts[1:], len(ids)]
+
+    # runs come row by row, the stable sort keeps them ordered inside each word
+    bboxes = np.column_stack((
+        np.minimum.reduceat(x1, starts) - 1,
+        ys[starts] - 1,
+        np.maximum.reduceat(x2, starts) + 3,
+        ys[ends - 1] + 3,
+    )).astype(np.float64)
+    bboxes = np.clip(bboxes, 0, [width, height, width, height])
+    bboxes /= [width, height, width, height]
+
+    num_pixels = np.add.reduceat(x2 - x1 + 1, starts)
+    keep = num_pixels >= min_pixels
+    return ids[starts][keep], bboxes[keep]
@@ -0,0 +1,173 @@
+from collections import namedtuple
+import itertools
+import re
+
+from bs4 import BeautifulSoup
+from lxml import etree
+import lxml.html
+
+from src.palette import MAX_WORDS
+
+
+Heading = namedtuple('Heading', ['level', 'text'])
+Paragraph = namedtuple('Paragraph', ['runs'])  # runs are (text, formatting) pairs, formatting is a tag name or None
+Table = namedtuple('Table', ['rows'])  # rows are lists of cell texts
+
+
+BRACKETS_RE = re.compile(r'\[.*?\]')
+
+
+def split_words(text):
+    if '[' in text:
+        text = BRACKETS_RE.sub('', text)
+    return text.split()
+
+
+NON_TEXT_TAGS = ('script', 'style', 'template')
+BLOCK_TAGS = ('p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'table')
+CONTENT_CLASS = 'mw-parser-output'
+HTML_PARSERS = ('lxml', 'html.parser')
+# walking stops once max_words is exceeded, so the last block adds at most this many words over it
+MAX_BLOCK_WORDS = 5000
+
+
+def check_max_words(docx_config):
+    """Every word of a document needs a color of the palette, max_words must leave room for the last block."""
+    if docx_config["max_words"] + MAX_BLOCK_WORDS > MAX_WORDS:
+        raise ValueError(f"max_words {docx_config['max_words']} plus the {MAX_BLOCK_WORDS} words a last block may add "
+                         f"exceeds the {MAX_WORDS} word colors of the palette")
+
+
+def html_to_blocks(html, docx_config, parser='lxml'):
+    """Parses article HTML into the blocks a DocxDocument is built from.
+
+    Only the page title and the article content container are walked, navigation and
+    page chrome outside of it are skipped. Content decisions that do not depend on the
+    random layout are made here once per article: repeated headings and too large
+    tables are dropped, and walking stops as soon as the blocks hold more than
+    max_words words. Both parsers emit the same blocks, lxml is several times faster.
+    """
+    builder = BlockBuilder(docx_config)
+    if parser == 'lxml':
+        _walk_lxml(html, builder)
+    elif parser == 'html.parser':
+        _walk_soup(html, builder)
+    else:
+        raise ValueError(f"Unknown HTML parser: {parser}")
+    return builder.blocks
+
+
+def _walk_soup(html, builder):
+    soup = BeautifulSoup(html, 'html.parser')
+    title = soup.find('h1', id='firstHeading')
+    content = soup.find('div', class_=CONTENT_CLASS)
+    if content is None:
+        # not a MediaWiki page, the whole document is the article
+        title, content = None, soup
+    elements = content.find_all(BLOCK_TAGS)
+    for element in ([title] if title is not None else []) + elements:
+        if element.name.startswith('h'):
+            builder.add_heading(int(element.name[1]), element.text)
+        elif element.name == "table":
+            builder.add_table([[cell.text.strip() for cell in row.find_all(['th', 'td'])]
+                               for row in element.find_all('tr')])
+        else:
+            builder.add_paragraph([(child.get_text(), child.name) for child in element.children])
+
+        if builder.is_full():
+            break
+
+
+def _walk_lxml(html, builder):
+    try:
+        try:
+            root = lxml.html.document_fromstring(html)
+        except ValueError:
+            # lxml refuses strings with an XML encoding declaration
+            root = lxml.html.document_fromstring(html.encode('utf-8'))
+    except etree.ParserError:
+        # the document is empty
+        return
+    title = root.xpath('//h1[@id="firstHeading"]')
+    content = root.xpath(f'//div[contains(concat(" ", normalize-space(@class), " "), " {CONTENT_CLASS} ")]')
+    if content:
+        elements = itertools.chain(title[:1], content[0].iter(BLOCK_TAGS))
+    else:
+        elements = root.iter(BLOCK_TAGS)
+    # iter is lazy, so nothing after the last needed block is visited
+    for element in elements:
+        if element.tag[0] == 'h':
+            builder.add_heading(int(element.tag[1]), _lxml_text(element))
+        elif element.tag == "table":
+            builder.add_table([[_lxml_text(cell).strip() for cell in row.iter('th', 'td')]
+                               for row in element.iter('tr')])
+        else:
+            runs = [(element.text, None)] if element.text else []
+            for child in element:
+                if isinstance(child.tag, str):
+                    runs.append((_lxml_text(child, own=True), child.tag))
+                else:
+                    # comments and processing instructions are empty runs in BeautifulSoup
+                    runs.append(('', None))
+                if child.tail:
+                    runs.append((child.tail, None))
+            builder.add_paragraph(runs)
+
+        if builder.is_full():
+            break
+
+
+def _lxml_text(element, own=False):
+    # matches BeautifulSoup: script and style contents only count when asked for directly
+    if own and element.tag in NON_TEXT_TAGS:
+        return element.text_content()
+    return ''.join(_iter_text(element))
+
+
+def _iter_text(element):
+    if element.text:
+        yield element.text
+    for child in element:
+        if isinstance(child.tag, str) and child.tag not in NON_TEXT_TAGS:
+            yield from _iter_text(child)
+        if child.tail:
+            yield child.tail
+
+
+class BlockBuilder:
+    def __init__(self, docx_config):
+        self.docx_config = docx_config
+        self.blocks = []
+        self.num_words = 0
+        self.last_is_heading = False
+
+    def add_heading(self, level, text):
+        # a heading directly after another heading is dropped, tables in between do not count
+        if self.last_is_heading:
+            return
+        if text not in ["Contents"] and self._add(Heading(level, text), len(split_words(text))):
+            self.last_is_heading = True
+
+    def add_table(self, rows):
+        if not rows or len(rows) > self.docx_config["table_max_rows"]:
+            return
+        # tables without cells have no width to split between columns
+        num_cols = max(len(row) for row in rows)
+        if num_cols == 0 or num_cols > self.docx_config["table_max_cols"]:
+            return
+        self._add(Table(rows), sum(len(split_words(cell)) for row in rows for cell in row))
+
+    def add_paragraph(self, runs):
+        if self._add(Paragraph(runs), sum(len(split_words(text)) for text, _ in runs)):
+            self.last_is_heading = False
+
+    def _add(self, block, num_words):
+        # larger blocks could take a document past the palette, see check_max_words
+        if num_words > MAX_BLOCK_WORDS:
+            return False
+        self.blocks.append(block)
+        self.num_words += num_words
+        return True
+
+    def is_full(self):
+        return self.num_words > self.docx_config["max_words"]
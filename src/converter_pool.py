@@ -0,0 +1,142 @@
+import os
+import signal
+import socket
+import subprocess
+import threading
+import time
+
+from unoserver import client
+
+
+class UnoserverInstance:
+    """One Unoserver process listening on a pair of ports."""
+
+    def __init__(self, port, uno_port):
+        self.port = port
+        self.uno_port = uno_port
+        self.process = None
+        self.client = None
+
+    def start(self):
+        command = ["/usr/bin/python3", "-m", "unoserver.server", "--port", str(self.port), "--uno-port", str(self.uno_port)]
+        print('START SERVER', self.port, self.uno_port)
+        # own process group, so soffice started by unoserver is killed together with it
+        self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                        start_new_session=True)
+        self.client = client.UnoClient(port=self.port)
+
+    def stop(self):
+        if self.process is None or self.process.poll() is not None:
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGTERM)
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            os.killpg(self.process.pid, signal.SIGKILL)
+            self.process.wait()
+        except ProcessLookupError:
+            pass
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def is_ready(self):
+        try:
+            with socket.create_connection(("127.0.0.1", self.port), timeout=1):
+                return True
+        except OSError:
+            return False
+
+    def convert(self, indata, convert_to):
+        return self.client.convert(indata=indata, convert_to=convert_to)
+
+
+class ConverterPool:
+    """Dispatches conversions to the least busy of several converter instances.
+
+    Instances are created by instance_factory(port, uno_port) and must provide start, stop,
+    is_alive, is_ready and convert(indata, convert_to), so the pool can be driven by a fake
+    local converter. Crashed instances are restarted, and every instance is recycled after
+    max_conversions conversions (0 disables recycling) to cap soffice memory growth.
+    """
+
+    def __init__(self, ports, max_conversions=0, start_timeout=60, instance_factory=UnoserverInstance):
+        self.max_conversions = max_conversions
+        self.start_timeout = start_timeout
+        self.instances = [instance_factory(port, uno_port) for port, uno_port in ports]
+        self.active = [0] * len(self.instances)
+        self.conversions = [0] * len(self.instances)
+        self.restarting = [False] * len(self.instances)
+        self.started = False
+        self.condition = threading.Condition()
+
+    def start(self):
+        with self.condition:
+            if self.started:
+                return
+            self.started = True
+        for instance in self.instances:
+            instance.start()
+        for instance in self.instances:
+            self._wait_ready(instance)
+
+    def stop(self):
+        for instance in self.instances:
+            instance.stop()
+
+    def convert(self, indata, convert_to='pdf'):
+        self.start()
+        i = self._acquire()
+        try:
+            return self.instances[i].convert(indata=indata, convert_to=convert_to)
+        except Exception:
+            if not self.instances[i].is_alive():
+                print(f'Converter on port {self.instances[i].port} crashed')
+                with self.condition:
+                    self.restarting[i] = True
+            raise
+        finally:
+            self._release(i)
+
+    def _acquire(self):
+        with self.condition:
+            while True:
+                available = [i for i in range(len(self.instances)) if not self.restarting[i]]
+                if available:
+                    i = min(available, key=lambda i: self.active[i])
+                    self.active[i] += 1
+                    self.conversions[i] += 1
+                    if self.max_conversions and self.conversions[i] >= self.max_conversions:
+                        # take the instance out of rotation, the last running conversion recycles it
+                        self.restarting[i] = True
+                    return i
+                self.condition.wait()
+
+    def _release(self, i):
+        with self.condition:
+            self.active[i] -= 1
+            restart = self.restarting[i] and self.active[i] == 0
+        if restart:
+            self._restart(i)
+
+    def _restart(self, i):
+        instance = self.instances[i]
+        print(f'Restarting converter on port {instance.port}')
+        try:
+            instance.stop()
+            instance.start()
+            self._wait_ready(instance)
+        finally:
+            with self.condition:
+                self.conversions[i] = 0
+                self.restarting[i] = False
+                self.condition.notify_all()
+
+    def _wait_ready(self, instance):
+        deadline = time.time() + self.start_timeout
+        while not instance.is_ready():
+            if not instance.is_alive():
+                raise RuntimeError(f'Converter on port {instance.port} exited during startup')
+            if time.time() > deadline:
+                raise RuntimeError(f'Converter on port {instance.port} is not ready after {self.start_timeout} seconds')
+            time.sleep(0.5)
@@ -0,0 +1,291 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import tarfile
+import threading
+import time
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from src.image_codecs import encode_image
+from src.metrics import Metrics
+
+
+OUTPUT_FORMATS = ('folder', 'tar', 'parquet')
+
+
+def sample_key(url, variant, page):
+    """Names a page by its url, document variant and page number, unique without any coordination.
+
+    The same page of a rerun gets the same name, so it replaces its previous output.
+    """
+    return f"{hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]}_{variant}_{page}"
+
+
+class FolderWriter:
+    """Two loose files per sample, {key}.png and {key}.png.json, and {key}_colored.png in debug mode.
+
+    Every file is written under a .tmp name and renamed, the annotation last, so a
+    sample is complete when its annotation exists, even if the run was killed.
+    Images encoded with another codec get its extension instead of png.
+    """
+
+    def __init__(self, folder, image_extension='png'):
+        self.folder = folder
+        self.image_extension = image_extension
+
+    def write(self, key, image, annotation, colored_image=None):
+        if colored_image is not None:
+            self._write_file(f"{key}_colored.png", colored_image)
+        self._write_file(f"{key}.{self.image_extension}", image)
+        self._write_file(f"{key}.{self.image_extension}.json", json.dumps(annotation).encode('utf-8'))
+
+    def on_durable(self, callback):
+        """Calls callback once the samples written so far are complete on disk, right away for loose files."""
+        callback()
+
+    def close(self):
+        pass
+
+    def _write_file(self, name, data):
+        path = self.folder / name
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{path}.tmp", path)
+
+
+class ShardWriter:
+    """Base class of writers packing samples into shards of about shard_size bytes.
+
+    Shards are named {prefix}-{number}.{extension}, and every shard has an index
+    {shard}.index.jsonl with one line per sample telling where it is in the shard.
+    A shard and its index are written under .tmp names and renamed when the shard is
+    full or the writer is closed, so every file with a final name is complete, and
+    on_durable callbacks wait for the rename of the open shard.
+    Samples are written by the threads of one process, each process and run has its own prefix.
+    """
+    extension = None
+
+    def __init__(self, folder, prefix, shard_size, image_extension='png'):
+        self.folder = folder
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.image_extension = image_extension
+        self.lock = threading.Lock()
+        self.num_shards = 0
+        self.shard_path = None
+        self.index = None
+        self.durable_callbacks = []
+
+    def write(self, key, image, annotation, colored_image=None):
+        with self.lock:
+            if self.shard_path is None:
+                self.shard_path = self.folder / f"{self.prefix}-{self.num_shards:05d}.{self.extension}"
+                self._open_shard(f"{self.shard_path}.tmp")
+                self.index = open(f"{self.shard_path}.index.jsonl.tmp", "w")
+            entry = self._write_sample(key, image, annotation, colored_image)
+            self.index.write(json.dumps({"key": key, **entry}) + "\n")
+            if self._shard_bytes() >= self.shard_size:
+                self._finish_shard()
+
+    def on_durable(self, callback):
+        """Calls callback once the samples written so far are in shards with their final names."""
+        with self.lock:
+            if self.shard_path is not None:
+                self.durable_callbacks.append(callback)
+                return
+        callback()
+
+    def close(self):
+        with self.lock:
+            if self.shard_path is not None:
+                self._finish_shard()
+
+    def _finish_shard(self):
+        self._close_shard()
+        self.index.close()
+        os.replace(f"{self.shard_path}.tmp", self.shard_path)
+        os.replace(f"{self.shard_path}.index.jsonl.tmp", f"{self.shard_path}.index.jsonl")
+        self.shard_path = None
+        self.num_shards += 1
+        callbacks, self.durable_callbacks = self.durable_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def _open_shard(self, path):
+        raise NotImplementedError
+
+    def _write_sample(self, key, image, annotation, colored_image):
+        raise NotImplementedError
+
+    def _shard_bytes(self):
+        raise NotImplementedError
+
+    def _close_shard(self):
+        raise NotImplementedError
+
+
+class TarShardWriter(ShardWriter):
+    """WebDataset tar shards: {key}.png (or the extension of the codec), {key}.json and {key}.colored.png in debug mode.
+
+    The index stores the offset and size of every member's data, so a sample can be
+    read with a single seek, without scanning the tar headers.
+    """
+    extension = 'tar'
+
+    def _open_shard(self, path):
+        self.tar = tarfile.open(path, 'w', format=tarfile.USTAR_FORMAT)
+
+    def _write_sample(self, key, image, annotation, colored_image):
+        members = {self.image_extension: image, "json": json.dumps(annotation).encode('utf-8')}
+        if colored_image is not None:
+            members["colored.png"] = colored_image
+        entry = {}
+        for extension, data in members.items():
+            info = tarfile.TarInfo(f"{key}.{extension}")
+            info.size = len(data)
+            info.mtime = time.time()
+            self.tar.addfile(info, io.BytesIO(data))
+            # the header comes first, the data is padded to the tar block size
+            data_offset = self.tar.offset - tarfile.BLOCKSIZE * -(-len(data) // tarfile.BLOCKSIZE)
+            entry[extension] = [data_offset, len(data)]
+        return entry
+
+    def _shard_bytes(self):
+        return self.tar.offset
+
+    def _close_shard(self):
+        self.tar.close()
+
+
+class ParquetShardWriter(ShardWriter):
+    """Parquet shards with a row per sample, images are stored as encoded bytes.
+
+    The image format is the extension of the codec, stored in the image_format
+    metadata of the schema. Rows are buffered and written in row groups of
+    row_group_size samples. The index stores the row number of every sample in its shard.
+    """
+    extension = 'parquet'
+    row_group_size = 64
+
+    def __init__(self, folder, prefix, shard_size, image_extension='png'):
+        if pa is None:
+            raise ImportError("The parquet output format requires pyarrow")
+        super().__init__(folder, prefix, shard_size, image_extension)
+        self.schema = pa.schema([("key", pa.string()),
+                                 ("image", pa.binary()),
+                                 ("words", pa.list_(pa.string())),
+                                 ("bboxes", pa.list_(pa.list_(pa.float64()))),
+                                 ("seed", pa.int64()),
+                                 ("layout_seed", pa.int64()),
+                                 ("colored_png", pa.binary())],
+                                metadata={"image_format": image_extension})
+
+    def _open_shard(self, path):
+        self.parquet = pq.ParquetWriter(path, self.schema)
+        self.rows = []
+        self.num_rows = 0
+        self.num_bytes = 0
+
+    def _write_sample(self, key, image, annotation, colored_image):
+        self.rows.append({"key": key, "image": image, "words": annotation["words"], "bboxes": annotation["bboxes"],
+                          "seed": annotation.get("seed"), "layout_seed": annotation.get("layout_seed"),
+                          "colored_png": colored_image})
+        self.num_bytes += len(image) + len(colored_image or b'') + sum(len(word) + 32 for word in annotation["words"])
+        if len(self.rows) >= self.row_group_size:
+            self._write_row_group()
+        self.num_rows += 1
+        return {"row": self.num_rows - 1}
+
+    def _write_row_group(self):
+        self.parquet.write_table(pa.Table.from_pylist(self.rows, schema=self.schema))
+        self.rows = []
+
+    def _shard_bytes(self):
+        return self.num_bytes
+
+    def _close_shard(self):
+        if self.rows:
+            self._write_row_group()
+        self.parquet.close()
+
+
+def open_writer(output_format, folder, prefix, shard_size_mb=256, image_extension='png'):
+    if output_format == 'folder':
+        return FolderWriter(folder, image_extension)
+    if output_format == 'tar':
+        return TarShardWriter(folder, prefix, shard_size_mb * 2 ** 20, image_extension)
+    if output_format == 'parquet':
+        return ParquetShardWriter(folder, prefix, shard_size_mb * 2 ** 20, image_extension)
+    raise ValueError(f"Unknown output format: {output_format}")
+
+
+class WriterPool:
+    """Encodes and writes samples in threads of its own, so page threads never wait for codecs or disk.
+
+    Samples are encoded as they are submitted, and written by a single committer thread when
+    the samples of a whole url are committed, so a url that fails halfway writes nothing and
+    its retry can reuse its keys. At most max_pending samples wait to be encoded, submit
+    blocks until one of them is done. OpenCV releases the GIL while encoding, so the threads
+    encode in parallel.
+    """
+
+    def __init__(self, writer, num_threads, max_pending, codec='png', quality=None, metrics=None):
+        self.writer = writer
+        self.codec = codec
+        self.quality = quality
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.executor = ThreadPoolExecutor(max_workers=num_threads,
+                                           thread_name_prefix=f"{multiprocessing.current_process().name}_writer")
+        # commits wait for encodes, they run apart so they never hold the threads the encodes need
+        self.committer = ThreadPoolExecutor(max_workers=1,
+                                            thread_name_prefix=f"{multiprocessing.current_process().name}_committer")
+
+    def submit(self, key, image, annotation, colored_image=None):
+        """Returns a future of the encoded sample, image and colored_image are RGB arrays."""
+        self.pending.acquire()
+        try:
+            future = self.executor.submit(self._encode, key, image, annotation, colored_image)
+        except BaseException:
+            self.pending.release()
+            raise
+        future.add_done_callback(lambda _: self.pending.release())
+        return future
+
+    def commit(self, futures):
+        """Writes the samples of futures of submit once all of them are encoded, without waiting for it.
+
+        Returns a future of the number of samples written, which fails if any of them failed.
+        """
+        return self.committer.submit(self._write, futures)
+
+    def on_durable(self, callback):
+        """Calls callback once the samples whose writes are done are complete on disk, see the writers."""
+        self.writer.on_durable(callback)
+
+    def close(self):
+        self.executor.shutdown()
+        self.committer.shutdown()
+        self.writer.close()
+
+    def _encode(self, key, image, annotation, colored_image):
+        with self.metrics.timer('encode'):
+            data = encode_image(image, self.codec, self.quality)
+            if colored_image is not None:
+                colored_image = encode_image(colored_image, 'png')
+        return key, data, annotation, colored_image
+
+    def _write(self, futures):
+        samples = [future.result() for future in futures]
+        for sample in samples:
+            with self.metrics.timer('write'):
+                self.writer.write(*sample)
+        return len(samples)
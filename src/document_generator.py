@@ -1,26 +1,27 @@
 import cProfile
 from concurrent.futures import ThreadPoolExecutor
-import json
+import functools
 import multiprocessing
 import os
 from pathlib import Path
-import subprocess
+import random
 from time import sleep
 import time
 import traceback
-from bs4 import BeautifulSoup
-import numpy as np
-from augraphy import AugraphyPipeline
-from unoserver import client
-import requests
+import uuid
 from tqdm import tqdm
 from PIL import Image, ImageDraw
-import cv2 
 import threading
 
-import src.utils as utils
-from src.augmentations import get_augmentation_phases
-from src.docx_document import DocxDocument
+from src.blocks import check_max_words, html_to_blocks
+from src.converter_pool import ConverterPool
+from src.dataset_writer import WriterPool, open_writer, sample_key
+from src.image_codecs import EXTENSIONS
+from src.metrics import Metrics, MetricsReporter
+from src.ooxml_document import create_document
+from src.page_pool import PagePool, process_page
+from src.rasterizer import get_rasterizer
+from src.sources import ArticleNotFound, open_source
 
 
 def profileit(func):
@@ -34,128 +35,236 @@ def profileit(func):
     return wrapper
 
 class DocumentGenerator:
-    def __init__(self, max_threads, image_size, docx_config, out_folder, port, uno_port, debug_mode):
+    def __init__(self, max_threads, image_size, docx_config, out_folder, ports, debug_mode, *,
+                 single_render=False, recycle_after=0, max_retries=2, corpus=None,
+                 http_cache=None, variants_per_url=1, html_parser='lxml', rasterizer='auto',
+                 pages_in_flight=0, output_format='folder', shard_size_mb=256, manifest=None, cpu_workers=0,
+                 metrics_interval=10, codec='png', quality=None, writer_threads=2):
+        check_max_words(docx_config)
         self.max_threads = max_threads
         self.image_size = image_size
         self.out_folder = out_folder
         self.docx_config = docx_config
-        self.port = port
-        self.uno_port = uno_port
+        self.ports = ports
         self.debug_mode = debug_mode
+        self.single_render = single_render
+        self.max_retries = max_retries
+        self.source = open_source(corpus, http_cache)
+        self.variants_per_url = variants_per_url
+        self.html_parser = html_parser
+        self.rasterizer = get_rasterizer(rasterizer)
+        self.page_slots = threading.BoundedSemaphore(pages_in_flight or max_threads)
+        self.pages_in_flight = pages_in_flight or max_threads
+        self.cpu_workers = cpu_workers
+        self.page_pool = None
+        self.output_format = output_format
+        self.shard_size_mb = shard_size_mb
+        self.codec = codec
+        self.quality = quality
+        self.writer_threads = writer_threads
+        self.writer_pool = None
+        self.manifest = manifest
         
         self.image_counter = 0
-    
-        command = f"/usr/bin/python3 -m unoserver.server --port {port} --uno-port {uno_port} > /dev/null 2>&1"
-        print('START SERVER', port, uno_port)
-        self.unoserver_process = subprocess.Popen(command, shell=True)
-        self.uno_client = client.UnoClient(port=port)
+        # counters and stage timers, reported to the manager every metrics_interval seconds
+        self.metrics = Metrics()
+        self.metrics_interval = metrics_interval
+        self.stats_lock = threading.Lock()
+        self.seed_generator = random.SystemRandom()
+
+        # servers are started lazily inside the generator process
+        self.converter_pool = ConverterPool(ports, max_conversions=recycle_after)
     
     def __del__(self):
-        self.unoserver_process.kill()
+        self.converter_pool.stop()
 
-    def generate(self, urls):
+    def generate(self, url_queue, stats_queue=None, metrics_queue=None):
+        """Pulls urls from url_queue until every thread receives a None poison pill."""
         print('Start Document Generator...')
-        with ThreadPoolExecutor(max_workers=self.max_threads, 
-                                thread_name_prefix=f"{multiprocessing.current_process().name}_thread") as executor:
-            futures = [executor.submit(self.create_doc_try_except, url) for url in urls]
-            for future in futures:
-                future.result()
-    
+        start_time = time.time()
+        reporter = None
+        if metrics_queue is not None:
+            reporter = MetricsReporter(self.metrics, metrics_queue, multiprocessing.current_process().name,
+                                       self.metrics_interval)
+            reporter.start()
+        # shards of every process and run get their own names, so no one writes to the same file
+        writer = open_writer(self.output_format, self.out_folder,
+                             f"{multiprocessing.current_process().name}-{uuid.uuid4().hex[:8]}", self.shard_size_mb,
+                             EXTENSIONS[self.codec])
+        self.writer_pool = WriterPool(writer, self.writer_threads, self.pages_in_flight, self.codec, self.quality,
+                                      self.metrics)
+        if self.cpu_workers > 0:
+            # a buffer holds the colored and the clean page, rendered with the sizes of render_images
+            self.page_pool = PagePool(self.cpu_workers, self.pages_in_flight, 3 * (1500 ** 2 + 1024 ** 2))
+            self.page_pool.start()
+        self.converter_pool.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_threads, 
+                                    thread_name_prefix=f"{multiprocessing.current_process().name}_thread") as executor:
+                futures = [executor.submit(self.consume_urls, url_queue) for _ in range(self.max_threads)]
+                for future in futures:
+                    future.result()
+        finally:
+            self.converter_pool.stop()
+            if self.page_pool is not None:
+                self.page_pool.stop()
+            self.writer_pool.close()
+            if reporter is not None:
+                reporter.stop()
+
+        if stats_queue is not None:
+            counters = self.metrics.snapshot()["counters"]
+            stats_queue.put({"name": multiprocessing.current_process().name,
+                             "threads": self.max_threads,
+                             "cpu_workers": self.cpu_workers,
+                             "elapsed": time.time() - start_time,
+                             "images": self.image_counter,
+                             **{counter: counters.get(counter, 0)
+                                for counter in ("urls", "failed_urls", "retries", "busy_time", "dropped_pages")}})
+
+    def consume_urls(self, url_queue):
+        while True:
+            url = url_queue.get()
+            if url is None:
+                return
+            start_time = time.time()
+            for attempt in range(self.max_retries + 1):
+                if attempt > 0:
+                    print(f'Retrying {url}, attempt {attempt + 1}')
+                try:
+                    written = self.create_doc_try_except(url)
+                except ArticleNotFound as e:
+                    # a missing article fails for good, it is recorded once without retries
+                    print(f'Article not found: {e}')
+                    written = None
+                    break
+                if written is not None:
+                    break
+            succeeded = written is not None
+            elapsed = time.time() - start_time
+            self.metrics.add("urls")
+            self.metrics.add("retries", attempt)
+            self.metrics.add("busy_time", elapsed)
+            if succeeded:
+                # the thread goes on with the next url while the pages are written
+                commit, page_words = written
+                commit.add_done_callback(functools.partial(self.url_written, url, attempt + 1, elapsed,
+                                                           threading.current_thread().name, page_words))
+            else:
+                self.url_failed(url, attempt + 1, elapsed, threading.current_thread().name)
+
+    def url_written(self, url, attempts, elapsed, worker, page_words, commit):
+        """Counts the images of a url once the writer pool has written them."""
+        try:
+            images = commit.result()
+        except Exception:
+            print(traceback.format_exc())
+            self.url_failed(url, attempts, elapsed, worker)
+            return
+        with self.stats_lock:
+            self.image_counter += images
+        self.metrics.add("pages", images)
+        self.metrics.add("page_words", page_words)
+        if self.manifest is not None:
+            # a url is done once its samples survive a kill, shards are only complete once renamed
+            self.writer_pool.on_durable(
+                functools.partial(self.manifest.record, url, True, images, attempts, elapsed, worker))
+
+    def url_failed(self, url, attempts, elapsed, worker):
+        self.metrics.add("failed_urls")
+        if self.manifest is not None:
+            self.manifest.record(url, False, 0, attempts, elapsed, worker)
+
     def create_doc_try_except(self, url):
+        """Returns the commit of the pages and their number of words, or None if fetching or generation failed."""
         try:
-            self.create_doc(url)
+            written = self.create_doc(url)
             print(f'{threading.current_thread().name} total images generated by the current process: {self.image_counter}')
+            return written
+        except ArticleNotFound:
+            raise
         except Exception as e:
             print(traceback.format_exc())
+            return None
 
     #@profileit
     def create_doc(self, url):
-        doc = DocxDocument(self.docx_config, self.uno_client)
-        response = requests.get(url)
-        if response.status_code != 200:
-            print(f"Bad Response: {response}")
-            return
+        with self.metrics.timer('fetch'):
+            html = self.source.fetch(url)
+        if html is None:
+            # a failed fetch fails the url, so it is retried and recorded as failed
+            return None
         
-        # create colored docx document
-        soup = BeautifulSoup(response.text, 'html.parser')
-        for element in soup.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', "table"]):
-            if element.name.startswith('h'):
-                doc.add_heading(element)
-            elif element.name == "table":
-                doc.add_table(element)
-            else:
-                doc.add_text(element)
-                
-            if doc.get_num_words() > self.docx_config["max_words"]:
-                break
-            
-        # extract annotations from colored images
+        # the article is parsed once, every variant samples its own random layout
+        with self.metrics.timer('parse'):
+            blocks = html_to_blocks(html, self.docx_config, self.html_parser)
+        encodes = []
+        for variant in range(self.variants_per_url):
+            # create colored docx document
+            with self.metrics.timer('build'):
+                doc = create_document(self.docx_config, self.converter_pool, self.rasterizer,
+                                      self.seed_generator.randrange(2 ** 31))
+                doc.add_blocks(blocks)
+            self.metrics.add("documents")
+            self.metrics.add("words", len(doc.words))
+            encodes += self.create_images(doc, url, variant)
+
+        # the pages of the url are written once all of them succeeded, so a failed attempt leaves
+        # no pages of its layout behind
+        commit = self.writer_pool.commit([future for future, _ in encodes])
+        return commit, sum(num_words for _, num_words in encodes)
+
+    def create_images(self, doc, url, variant):
+        """Runs every page: render, extract bboxes, augment and resize, then hands it to the writer pool.
+
+        Pages are rendered lazily, and a page is only rendered while the process has fewer
+        than pages_in_flight pages between rendering and the writer pool, so memory is bounded by
+        that number of colored and clean pages, whatever the number of threads and pages.
+        Returns the pending encodes as (future, number of words) pairs.
+        """
+        with self.metrics.timer('convert'):
+            pages = enumerate(zip(*self.render_images(doc)))
+        encodes = []
+        while True:
+            with self.page_slots:
+                with self.metrics.timer('rasterize'):
+                    page = next(pages, None)
+                if page is None:
+                    return encodes
+                page_number, (colored_image, image) = page
+                encode = self.create_image(colored_image, image, doc.words, doc.seed,
+                                           sample_key(url, variant, page_number))
+                if encode is not None:
+                    encodes.append(encode)
+                # the page is released before the next one is rendered
+                page = None
+
+    def create_image(self, colored_image, image, words, layout_seed, key):
+        seed = self.seed_generator.randrange(2 ** 31)
+        args = (len(words), seed, self.image_size, words if self.debug_mode else None)
+        if self.page_pool is not None and self.page_pool.fits((colored_image, image)):
+            ids, bboxes, final_image, colored_debug_image, stage_seconds = self.page_pool.run(
+                process_page, (colored_image, image), *args)
+        else:
+            ids, bboxes, final_image, colored_debug_image, stage_seconds = process_page(colored_image, image, *args)
+        for stage, seconds in stage_seconds.items():
+            self.metrics.observe(stage, seconds)
+        annotation = {"words": [words[i] for i in ids], "bboxes": bboxes, "seed": seed, "layout_seed": layout_seed}
+
+        # the annotation is validated here, nothing is checked after the run
+        if len(annotation["words"]) != len(annotation["bboxes"]):
+            self.metrics.add("dropped_pages")
+            return None
+        # encoding and writing run in the writer pool, the page thread goes on with the next page
+        return self.writer_pool.submit(key, final_image, annotation, colored_debug_image), len(ids)
+
+    def render_images(self, doc):
+        if self.single_render:
+            rendered = doc.get_colored_and_clean_images(dpi=200, colored_size=1500, clean_size=1024)
+            if rendered is not None:
+                return rendered
+            print('Colored and clean halves paginate differently, falling back to two conversions')
         colored_images = doc.get_images(dpi=200, image_size=1500)
-        annotations = self.get_bboxes(colored_images, doc.color2word)  # bboxes are normalized to [0,1]
         doc.convert_to_uncolored_docx()
-        images = doc.get_images(dpi=200, image_size=1024)  # get images for augmentation stage        
-        for i, image in enumerate(images):
-            if len(annotations[i]['words']) != len(annotations[i]['bboxes']):
-                continue
-            # unnormalize bboxes to augmentation image size
-            bounding_boxes = np.array(annotations[i]["bboxes"])
-            bounding_boxes = utils.unnormalize_bboxes(bounding_boxes, colored_images[0].size[0], colored_images[0].size[1])
-
-            # perform augmentation
-            augmentation_pipeline = AugraphyPipeline(bounding_boxes=bounding_boxes,
-                                                     log=False, **get_augmentation_phases())
-            augmented_cv2, _, _, augmented_bounding_boxes = augmentation_pipeline(np.array(image))
-            augmented_image = Image.fromarray(augmented_cv2)
-            with threading.Lock():
-                if self.debug_mode:
-                    bboxes_for_image = utils.normalize_bboxes(augmented_bounding_boxes, colored_images[0].size[0], colored_images[0].size[1])
-                    bboxes_for_image = utils.unnormalize_bboxes(bboxes_for_image, augmented_image.size[0], augmented_image.size[1])
-
-                    augmented_image = utils.draw_bboxes_pil(augmented_image, bboxes_for_image, annotations[i]["words"])
-                    colored_image = utils.draw_bboxes_pil(colored_images[i], bounding_boxes, annotations[i]["words"])
-                    colored_image.save(self.out_folder / f"im_{self.image_counter}_colored.png")
-
-                # resize image to final dataset size and save 
-                augmented_image = augmented_image.resize((self.image_size, self.image_size))
-                augmented_image.save(self.out_folder / f"im_{self.image_counter}.png")
-                
-                # convert booxes to (x, y, w, h) format and normalize to [0,1]
-                augmented_bounding_boxes = np.array(augmented_bounding_boxes).astype(int)
-                annotations[i]["bboxes"] = utils.normalize_bboxes(augmented_bounding_boxes, colored_images[0].size[0], colored_images[0].size[1]).tolist()
-                
-                # save annotation
-                with open(self.out_folder/ f"im_{self.image_counter}.png.json", "w") as f:
-                    json.dump(annotations[i], f)
-                self.image_counter += 1       
-  
-    def get_bboxes(self, images, color2word):
-        annotations = []
-        for image_pil in images:
-            width, height = image_pil.size
-            image_annotations = {"words": [], "bboxes": []}
-            image = np.asarray(image_pil)
-
-            thr = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-            thr = cv2.threshold(thr, 254, 255, cv2.THRESH_BINARY_INV)[1]
-            cnts = cv2.findContours(thr, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
-
-            for c in cnts:
-                peri = cv2.arcLength(c, True)
-                approx = cv2.approxPolyDP(c, 0.015 * peri, True)
-
-                if len(approx) == 4:
-                    x, y, w, h = cv2.boundingRect(approx)
-                    rgb_color = image_pil.getpixel((x+1, y+1))
-                    color = '#%02x%02x%02x' % (rgb_color)
-                    if color in color2word:
-                        word = color2word[color]
-                        image_annotations['words'].append(word)
-                        image_annotations["bboxes"].append(
-                            (
-                                x / width, 
-                                y / height, 
-                                (x + w) / width, 
-                                (y + h) / height)
-                             )
-            annotations.append(image_annotations)
-        return annotations
+        images = doc.get_images(dpi=200, image_size=1024)  # get images for augmentation stage
+        return colored_images, images
@@ -1,16 +1,43 @@
+import copy
 import cProfile
 import io
 import re
+import zipfile
+from xml.sax.saxutils import escape
 from docx import Document
+from docx.enum.style import WD_STYLE_TYPE
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT, WD_LINE_SPACING
-from docx.oxml.ns import qn
-from docx.shared import Pt, RGBColor
-from docx.oxml import OxmlElement
-import matplotlib.font_manager
+from docx.oxml.ns import nsdecls, qn
+from docx.shared import Emu, Pt
+from docx.oxml import OxmlElement, parse_xml
 import numba
 import numpy as np
-from pdf2image import convert_from_bytes
-from PIL import Image
+from lxml import etree
+
+from src.blocks import Heading, Table, split_words
+from src.docx_resources import get_available_fonts, get_color_palette
+from src.rasterizer import get_rasterizer
+from src.word_store import WordStore
+
+
+# rPr children before and after w:color, in the schema order b, i, color, u, shd
+RUN_STYLES = {'b': ('<w:b/>', ''), 'i': ('<w:i/>', ''), 'u': ('', '<w:u w:val="single"/>')}
+TABLE_BORDERS = ('top', 'left', 'bottom', 'right', 'insideH', 'insideV')
+NAMESPACES_RE = re.compile(r'(?: xmlns:\w+="[^"]*")+')
+SPACE_RUN = '<w:r><w:t xml:space="preserve"> </w:t></w:r>'
+FIRST_SPACE_RUN = '<w:r><w:t xml:space="preserve">    </w:t></w:r>'
+XML_DECLARATION = "<?xml version='1.0' encoding='UTF-8' standalone='yes'?>\n"
+
+
+def _replace_part(package_bytes, name, data):
+    """Returns the zip package with the part name replaced by data, the other parts are copied as they are."""
+    out = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(package_bytes)) as source, zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as target:
+        for info in source.infolist():
+            target.writestr(info, data if info.filename == name else source.read(info))
+    return out.getvalue()
+
+
 def profileit(func):
     def wrapper(*args, **kwargs):
         datafn = func.__name__ + ".profile" # Name the data file sensibly
@@ -22,251 +49,260 @@ def profileit(func):
     return wrapper
 
 class DocxDocument:
-    def __init__(self, docx_config, uno_client):
+    def __init__(self, docx_config, uno_client, rasterizer=None, seed=None):
         self.docx_config = docx_config
         self.uno_client = uno_client
+        self.rasterizer = rasterizer if rasterizer is not None else get_rasterizer()
 
-        self.doc = Document()
-        self.colors = self._init_colors(docx_config["max_words"])
+        self.colors = get_color_palette()
 
-        self.color2word = {}
-        self.color_ptr = 0
+        self.words = WordStore()
+        self.paragraph_ptr = 0
 
-        # sample random settings from docx_config 
-        if np.random.binomial(1, self.docx_config["p_2columns"]):
+        # sample random settings from docx_config, with a generator of its own so threads do not share draws
+        self.seed = seed
+        self.rng = np.random.RandomState(seed)
+        if self.rng.binomial(1, self.docx_config["p_2columns"]):
             self.num_columns = 2
         else:
             self.num_columns = 1
-        self.configure_several_columns()
 
-        self.font_size = Pt(np.random.randint(*self.docx_config["font_size_interval"]))
-        self.font_name = np.random.choice(self._list_available_fonts())
+        self.font_size = Pt(self.rng.randint(*self.docx_config["font_size_interval"]))
+        self.font_name = self.rng.choice(get_available_fonts())
         
-        self.line_spacing = np.random.choice(
+        self.line_spacing = self.rng.choice(
             (WD_LINE_SPACING.ONE_POINT_FIVE, WD_LINE_SPACING.DOUBLE), 
             p=self._normalize_probabilities(self.docx_config["p_line_spacing"])) 
 
-        self.paragraph_alignment = np.random.choice(
+        self.paragraph_alignment = self.rng.choice(
             (WD_PARAGRAPH_ALIGNMENT.CENTER, WD_PARAGRAPH_ALIGNMENT.LEFT, 
              WD_PARAGRAPH_ALIGNMENT.RIGHT, WD_PARAGRAPH_ALIGNMENT.JUSTIFY), 
             p=self._normalize_probabilities(self.docx_config["p_text_alignment"]))
     
-        self.heading_bold = bool(np.random.binomial(1, self.docx_config["p_heading_bold"]))
-        self.heading_relative_size = np.random.uniform(*self.docx_config["heading_relative_size_interval"])
+        self.heading_bold = bool(self.rng.binomial(1, self.docx_config["p_heading_bold"]))
+        self.heading_relative_size = self.rng.uniform(*self.docx_config["heading_relative_size_interval"])
         self.heading_size = Pt(self.heading_relative_size * self.font_size)
-        self.heading_alignment = np.random.choice(
+        self.heading_alignment = self.rng.choice(
             (WD_PARAGRAPH_ALIGNMENT.CENTER, WD_PARAGRAPH_ALIGNMENT.LEFT, 
              WD_PARAGRAPH_ALIGNMENT.RIGHT, WD_PARAGRAPH_ALIGNMENT.JUSTIFY), 
             p=self._normalize_probabilities(self.docx_config["p_heading_alignment"]))
+
+        self.create_document()
     
     def _normalize_probabilities(self, p):
         return np.array(p) / sum(p)
 
-    def _list_available_fonts(self):
-        font_paths = matplotlib.font_manager.findSystemFonts(fontpaths=None, fontext='ttf')
-        font_names = set()
-
-        for font_path in font_paths:
-            try:
-                font = matplotlib.font_manager.get_font(font_path)
-                font_names.add(font.family_name)
-            except RuntimeError as e:
-                print(f"Could not load font from path: {font_path}, error: {e}")
-        return list(font_names)
-    
-    def _init_colors(self, max_colors):
-        colors = []
-        hex_color = "#000000"
-        x = int(max_colors ** (1/3)) + 1
-        for i in range(x):
-            for j in range(x):
-                for k in range(x):
-                    # Convert HEX to RGB
-                    r = int(hex_color[1:3], 16)
-                    g = int(hex_color[3:5], 16)
-                    b = int(hex_color[5:7], 16)
-
-                    # Increment RGB values
-                    r = (r + i) % 256
-                    g = (g + j) % 256
-                    b = (b + k) % 256
-                    hex_color = '#{:02x}{:02x}{:02x}'.format(r, g, b)
-                    colors.append(hex_color)
-        return colors
-    
-    def configure_several_columns(self):
+    def create_document(self):
+        self.doc = Document()
         section = self.doc.sections[0]
-        sectPr = section._sectPr
-        cols = sectPr.xpath('./w:cols')[0]
+        self.block_width = section.page_width - section.left_margin - section.right_margin
+        self.sect_pr = self.doc.element.body.find(qn('w:sectPr'))
+        self.colored_body = []
+        self.clean_body = []
+        self.colored = True
+        self.configure_several_columns()
+        self.configure_styles(self.doc.styles)
+
+        # document.xml around the blocks, the body of the new document only holds sectPr
+        document_xml = etree.tostring(self.doc.element, encoding='unicode')
+        body_start = document_xml.index('<w:body>') + len('<w:body>')
+        self.document_head, self.document_tail = document_xml[:body_start], document_xml[body_start:]
+
+    def configure_several_columns(self):
+        cols = self.sect_pr.xpath('./w:cols')[0]
         cols.set(qn('w:num'), str(self.num_columns))    
 
-    def add_paragraph(self):
-        paragraph = self.doc.add_paragraph()
-        paragraph.alignment = self.paragraph_alignment
-        paragraph.paragraph_format.space_after = 0
-        paragraph.paragraph_format.line_spacing_rule = self.line_spacing
-        
-        return paragraph
+    def configure_styles(self, styles):
+        # formatting shared by all words lives in styles, so runs only carry their color
+        for style in [styles['Normal'], *(styles[f'Heading {level}'] for level in range(1, 10))]:
+            style.font.name = self.font_name
+            style.font.size = self.font_size
+            # theme fonts take precedence over the explicit font name
+            r_fonts = style.element.rPr.rFonts
+            for attribute in ('w:asciiTheme', 'w:hAnsiTheme'):
+                r_fonts.attrib.pop(qn(attribute), None)
+            if style.name.startswith('Heading'):
+                style.paragraph_format.alignment = self.heading_alignment
 
-    def add_heading(self, element):
-        text = element.text
-        level = int(element.name[1])
-        
-        if len(self.doc.paragraphs) > 1 and "Heading" in self.doc.paragraphs[-2].style.style_id:
-            return
-        
-        if text not in ["Contents"]:
-            paragraph = self.doc.add_heading(level=level)
-            _, metadata = self.add_words(text, paragraph)
-            self.color2word.update(metadata)
-            #for run in paragraph.runs:
-                #run.font.size = self.heading_size
-            paragraph.alignment = self.heading_alignment
-            
-            p = self.add_paragraph()
-            p.paragraph_format.line_spacing_rule = WD_LINE_SPACING.SINGLE
+        text_style = styles.add_style('Article Text', WD_STYLE_TYPE.PARAGRAPH)
+        text_style.base_style = styles['Normal']
+        text_style.paragraph_format.alignment = self.paragraph_alignment
+        text_style.paragraph_format.space_after = 0
+        text_style.paragraph_format.line_spacing_rule = self.line_spacing
+
+        spacer_style = styles.add_style('Heading Spacer', WD_STYLE_TYPE.PARAGRAPH)
+        spacer_style.base_style = text_style
+        spacer_style.paragraph_format.line_spacing_rule = WD_LINE_SPACING.SINGLE
+
+        self.text_style_id = text_style.style_id
+        self.spacer_style_id = spacer_style.style_id
+
+    def add_body_xml(self, xml, clean_xml):
+        """Appends a block to the body, given as XML of its colored and uncolored variants.
+
+        Block XML is written without namespace declarations, as it appears in document.xml.
+        """
+        self.sect_pr.addprevious(parse_xml(f'<w:body {nsdecls("w")}>{xml}</w:body>')[0])
+        self.colored_body.append(xml)
+        self.clean_body.append(clean_xml)
+
+    def add_paragraph(self, style_id, runs=(), clean_runs=()):
+        head = f'<w:p><w:pPr><w:pStyle w:val="{style_id}"/></w:pPr>'
+        self.add_body_xml(f'{head}{"".join(runs)}</w:p>', f'{head}{"".join(clean_runs)}</w:p>')
+
+    def add_blocks(self, blocks):
+        for block in blocks:
+            if isinstance(block, Heading):
+                self.add_heading(block.level, block.text)
+            elif isinstance(block, Table):
+                self.add_table(block.rows)
+            else:
+                self.add_text(block.runs)
+
+    def add_heading(self, level, text):
+        runs, clean_runs = [], []
+        self.add_words(runs, clean_runs, text, self._next_paragraph_id())
+        self.add_paragraph(f'Heading{level}', runs, clean_runs)
+        self.add_paragraph(self.spacer_style_id)
     
-    def add_table(self, html_element):
-        rows = html_element.find_all('tr')
-        parsed_table = []
-        for row in rows:
-            cells = row.find_all(['th', 'td'])
-            parsed_row = []
-            for cell in cells:
-                parsed_row.append(cell.text.strip())
-            parsed_table.append(parsed_row)
-
-        rows = len(parsed_table)
-        cols = max(len(row) for row in parsed_table)
-        if rows <= self.docx_config["table_max_rows"] and cols <= self.docx_config["table_max_cols"]:
-            table = self.doc.add_table(rows=len(parsed_table), cols=max(len(row) for row in parsed_table))
-            table.style = 'TableGrid'
-            self.set_table_border_color(table, "FFFFFF")
-            # Populating table data
-            for i, row_data in enumerate(parsed_table):
-                for j, cell_data in enumerate(row_data):
-                    _, metadata = self.add_words(cell_data, table.cell(i, j).paragraphs[0])
-                    self.color2word.update(metadata)
-                    '''table.cell(i, j).paragraphs[0].paragraph_format.line_spacing = Pt(24)
-                    for run in table.cell(i, j).paragraphs[0].runs:
-                        run.font.size = self.doc_config["font_size"]'''
-    def add_text(self, html_element):
-        paragraph = self.add_paragraph()
+    def add_table(self, rows):
+        # the same table as Document.add_table with the Table Grid style and colored borders
+        num_cols = max(len(row) for row in rows)
+        width = Emu(self.block_width // num_cols).twips
+        cells, clean_cells = [], []
+        for row_data in rows:
+            for j in range(num_cols):
+                runs, clean_runs = [], []
+                if j < len(row_data):
+                    self.add_words(runs, clean_runs, row_data[j], self._next_paragraph_id())
+                tc_pr = f'<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="{width}"/></w:tcPr><w:p>'
+                cells.append(f'{tc_pr}{"".join(runs)}</w:p></w:tc>')
+                clean_cells.append(f'{tc_pr}{"".join(clean_runs)}</w:p></w:tc>')
+        self.add_body_xml(self._table_xml(cells, num_cols, width, "FFFFFF"),
+                          self._table_xml(clean_cells, num_cols, width, "000000"))
+
+    def _table_xml(self, cells, num_cols, width, border_color):
+        borders = ''.join(f'<w:{border} w:val="single" w:sz="4" w:space="0" w:color="{border_color}"/>'
+                          for border in TABLE_BORDERS)
+        grid = f'<w:gridCol w:w="{width}"/>' * num_cols
+        rows = ''.join(f'<w:tr>{"".join(cells[i:i + num_cols])}</w:tr>' for i in range(0, len(cells), num_cols))
+        return (f'<w:tbl><w:tblPr><w:tblStyle w:val="TableGrid"/><w:tblW w:type="auto" w:w="0"/>'
+                f'<w:tblLook w:firstColumn="1" w:firstRow="1" w:lastColumn="0" w:lastRow="0" w:noHBand="0" '
+                f'w:noVBand="1" w:val="04A0"/><w:tblBorders>{borders}</w:tblBorders></w:tblPr>'
+                f'<w:tblGrid>{grid}</w:tblGrid>{rows}</w:tbl>')
+
+    def add_text(self, runs):
+        paragraph_id = self._next_paragraph_id()
+        xml_runs, clean_runs = [], []
         prev_word = " "
         first_word = True
-        for i, child in enumerate(html_element.children):
+        for i, (text, formatting) in enumerate(runs):
             if i > 0:
                 first_word = False
-            prev_word, metadata = self.add_words(child.get_text(), paragraph, formatting=child.name, prev_word=prev_word, first_word=first_word)
-            self.color2word.update(metadata)
-
-    def add_words(self, text, paragraph, formatting=None, prev_word=" ", first_word=False):
-        text = re.sub(r'\[.*?\]', '', text)
-        words = re.split(r'\s+', text)
-        metadata = {}
-        for word in words:
-            if word:
-                if word[0] not in ",.?!:;)}]»" and prev_word[-1] not in "«[{(":
-                    if first_word:
-                        paragraph.add_run(' ' * 4)
-                    else:
-                        paragraph.add_run(' ')
-
-                run = paragraph.add_run(word)
-                color = self.color_word(run)
-                metadata[color] = word
-                if formatting == 'b':
-                    run.bold = True
-                if formatting == 'i':
-                    run.italic = True
-                if formatting == 'u':
-                    run.underline = True
-                prev_word = word
-                run.font.size = self.font_size
-                run.font.name = self.font_name
-        return prev_word, metadata
-    
-    def color_word(self, run):
-        color = self.colors[self.color_ptr]
+            prev_word = self.add_words(xml_runs, clean_runs, text, paragraph_id, formatting=formatting, prev_word=prev_word, first_word=first_word)
+        self.add_paragraph(self.text_style_id, xml_runs, clean_runs)
 
-        self.color_ptr += 1
-        tag = run._r
+    def _next_paragraph_id(self):
+        self.paragraph_ptr += 1
+        return self.paragraph_ptr - 1
 
-        # Create XML element
-        shd = OxmlElement('w:shd')
+    def add_words(self, runs, clean_runs, text, paragraph_id, formatting=None, prev_word=" ", first_word=False):
+        """Appends the XML of space and word runs to runs, colored by word id, and to clean_runs, black on white.
 
-        # Add attributes to the element
-        shd.set(qn('w:val'), 'clear')
-        shd.set(qn('w:color'), 'auto')
-        shd.set(qn('w:fill'), color)
+        Returns the last word.
+        """
+        before_color, after_color = RUN_STYLES.get(formatting, ('', ''))
+        for word in split_words(text):
+            if word[0] not in ",.?!:;)}]»" and prev_word[-1] not in "«[{(":
+                space = FIRST_SPACE_RUN if first_word else SPACE_RUN
+                runs.append(space)
+                clean_runs.append(space)
 
-        # Set the font size - this is important! Without this step the
-        # tag.rPr value below will be None.
-        run.element.get_or_add_rPr()
+            color = self.colors[self.words.add(word, paragraph_id, formatting)]
+            text_xml = escape(word)
+            runs.append(f'<w:r><w:rPr>{before_color}<w:color w:val="{color}"/>{after_color}'
+                        f'<w:shd w:val="clear" w:color="auto" w:fill="{color}"/></w:rPr><w:t>{text_xml}</w:t></w:r>')
+            clean_runs.append(f'<w:r><w:rPr>{before_color}<w:color w:val="000000"/>{after_color}'
+                              f'<w:shd w:val="clear" w:color="auto" w:fill="#FFFFFF"/></w:rPr><w:t>{text_xml}</w:t></w:r>')
+            prev_word = word
+        return prev_word
+    
+    def save_docx(self, path):
+        self.doc.save(path)
 
-        tag.rPr.append(shd)
+    #@profileit
+    def get_images(self, image_size, dpi):
+        """Converts the document and returns a lazy iterator over its pages as RGB arrays."""
+        pdf_bytes = self._convert_to_pdf(self._get_docx_bytes())
+        return self.rasterizer.iter_pages(pdf_bytes, dpi=dpi, size=image_size)
 
-        run.font.color.rgb = RGBColor(*tuple(int(color[i:i + 2], 16) for i in (1, 3, 5)))
-        return color
+    def get_colored_and_clean_images(self, dpi, colored_size, clean_size):
+        """Renders colored and clean pages with a single docx -> pdf conversion.
 
-    def set_table_border_color(self, table, color):
-        tbl = table._element
-        tbl_pr = tbl.tblPr
+        The uncolored body is placed behind the colored one after a section break,
+        and the resulting pdf is rasterized lazily as two page ranges. Colored page i is
+        paired with clean page half + i only if both hold the same text, the halves paginate
+        identically. Returns None otherwise, so the caller can fall back to two conversions.
+        """
+        pdf_bytes = self._convert_to_pdf(self._get_single_render_docx_bytes())
+        page_texts = self.rasterizer.page_texts(pdf_bytes)
+        half = len(page_texts) // 2
+        if len(page_texts) % 2 != 0 or page_texts[:half] != page_texts[half:]:
+            return None
+        colored_images = self.rasterizer.iter_pages(pdf_bytes, dpi=dpi, size=colored_size, last_page=half)
+        clean_images = self.rasterizer.iter_pages(pdf_bytes, dpi=dpi, size=clean_size, first_page=half + 1)
+        return colored_images, clean_images
 
-        # Create a new border element
-        tbl_borders = OxmlElement('w:tblBorders')
+    def _get_single_render_docx_bytes(self):
+        section_break = self._serialize(self._create_section_break(self.sect_pr))
+        # both halves end with the same empty paragraph, so they paginate identically
+        return self._get_docx_bytes(f'{"".join(self.colored_body)}{section_break}{"".join(self.clean_body)}<w:p/>')
 
-        # Create a list of border attributes
-        borders = [
-            'top',
-            'left',
-            'bottom',
-            'right',
-            'insideH',
-            'insideV'
-        ]
+    def _get_docx_bytes(self, body_xml=None):
+        """Saves the document, or a document with the given body XML instead of the current one."""
+        if body_xml is None:
+            if self.colored:
+                out = io.BytesIO()
+                self.doc.save(out)
+                return out.getvalue()
+            body_xml = ''.join(self.clean_body)
 
-        # Iterate through each border attribute
-        for border in borders:
-            border_element = OxmlElement(f'w:{border}')
-            border_element.set(qn('w:val'), 'single')
-            border_element.set(qn('w:sz'), '4')
-            border_element.set(qn('w:space'), '0')
-            border_element.set(qn('w:color'), color)
-            tbl_borders.append(border_element)
+        # the package is saved with an empty body, and the body XML is spliced into its
+        # document.xml as a string, so nothing proportional to the words is parsed
+        part = self.doc.part
+        element = part._element
+        part._element = parse_xml(f'{self.document_head}{self.document_tail}')
+        try:
+            out = io.BytesIO()
+            self.doc.save(out)
+        finally:
+            part._element = element
+        document_xml = f'{XML_DECLARATION}{self.document_head}{body_xml}{self.document_tail}'
+        return _replace_part(out.getvalue(), 'word/document.xml', document_xml)
 
-        tbl_pr.append(tbl_borders)
+    def _serialize(self, element):
+        # namespace declarations are inherited from the root element of the part
+        return NAMESPACES_RE.sub('', etree.tostring(element, encoding='unicode'), count=1)
 
-    def save_docx(self, path):
-        self.doc.save(path)
+    def _convert_to_pdf(self, doc_bytes):
+        return self.uno_client.convert(indata=doc_bytes, convert_to='pdf')
+
+    def _create_section_break(self, sect_pr):
+        paragraph = OxmlElement('w:p')
+        p_pr = OxmlElement('w:pPr')
+        section = copy.deepcopy(sect_pr)
+        section_type = section.find(qn('w:type'))
+        if section_type is None:
+            section_type = OxmlElement('w:type')
+            section.insert(0, section_type)
+        section_type.set(qn('w:val'), 'nextPage')
+        p_pr.append(section)
+        paragraph.append(p_pr)
+        return paragraph
 
-    #@profileit
-    def get_images(self, image_size, dpi) -> list[Image]:
-        out = io.BytesIO()
-        self.doc.save(out)
-        doc_bytes = out.getvalue()
-        pdf_bytes = self.uno_client.convert(indata=doc_bytes, convert_to='pdf')
-        return convert_from_bytes(pdf_bytes, dpi=dpi, size=image_size) 
-    
     def convert_to_uncolored_docx(self):
-        for paragraph in self.doc.paragraphs:
-            for run in paragraph.runs:
-                run.font.color.rgb = RGBColor(0, 0, 0)
-                rpr = run.element.get_or_add_rPr()
-                element = rpr.find(qn('w:shd'))
-                if element is not None:
-                    element.set(qn('w:fill'), "#FFFFFF")
-
-        for table in self.doc.tables:
-            self.set_table_border_color(table, "000000")
-            for row in table.rows:
-                for cell in row.cells:
-                    for run in cell.paragraphs[0].runs:
-                        run.font.color.rgb = RGBColor(0, 0, 0)
-                        rpr = run.element.get_or_add_rPr()
-                        element = rpr.find(qn('w:shd'))
-                        if element is not None:
-                            element.set(qn('w:fill'), "#FFFFFF")
+        # the uncolored variant was written with the document, saving switches to it
+        self.colored = False
         
     def get_num_words(self):
-        return len(self.color2word)
+        return len(self.words)
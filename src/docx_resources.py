@@ -0,0 +1,88 @@
+import functools
+import hashlib
+import json
+import os
+from pathlib import Path
+import threading
+
+import matplotlib.font_manager
+import numpy as np
+
+from src import palette
+
+
+CACHE_DIR = Path(os.environ.get('DOGE_CACHE_DIR', Path.home() / '.cache' / 'doge'))
+
+_lock = threading.Lock()
+_available_fonts = None
+
+
+def get_available_fonts():
+    """Font family names installed on the system, computed once per process.
+
+    The list is also stored on disk under a key derived from the installed font files,
+    so new processes only pay for a directory scan.
+    """
+    global _available_fonts
+    with _lock:
+        if _available_fonts is None:
+            _available_fonts = _load_available_fonts()
+        return _available_fonts
+
+
+def clear_caches(disk=False):
+    global _available_fonts
+    with _lock:
+        _available_fonts = None
+        get_color_palette.cache_clear()
+        if disk:
+            for path in CACHE_DIR.glob('fonts_*.json'):
+                path.unlink()
+
+
+@functools.lru_cache(maxsize=None)
+def get_color_palette():
+    """Hex color of every word id, as used by w:fill and w:color."""
+    hex_colors = palette.ids_to_rgb(np.arange(palette.MAX_WORDS)).tobytes().hex().upper()
+    return tuple(hex_colors[i:i + 6] for i in range(0, len(hex_colors), 6))
+
+
+def _fontconfig_key(font_paths):
+    state = hashlib.sha1()
+    for font_path in sorted(font_paths):
+        try:
+            stat = os.stat(font_path)
+        except OSError:
+            continue
+        state.update(f'{font_path}:{stat.st_mtime_ns}:{stat.st_size}\n'.encode())
+    return state.hexdigest()
+
+
+def _load_available_fonts():
+    font_paths = matplotlib.font_manager.findSystemFonts(fontpaths=None, fontext='ttf')
+    cache_path = CACHE_DIR / f'fonts_{_fontconfig_key(font_paths)}.json'
+    if cache_path.exists():
+        try:
+            with open(cache_path, 'r') as f:
+                return tuple(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"Could not read font cache {cache_path}, error: {e}")
+
+    font_names = set()
+    for font_path in font_paths:
+        try:
+            font = matplotlib.font_manager.get_font(font_path)
+            font_names.add(font.family_name)
+        except RuntimeError as e:
+            print(f"Could not load font from path: {font_path}, error: {e}")
+    font_names = tuple(sorted(font_names))
+
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = cache_path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(font_names, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"Could not write font cache {cache_path}, error: {e}")
+    return font_names
@@ -0,0 +1,99 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import requests
+
+
+class HttpCache:
+    """On-disk cache of successful GET responses keyed by url.
+
+    Bodies are stored zlib compressed in SQLite, which lets every thread of every process
+    share one cache file. Cached responses are served without network calls, unless
+    revalidate is set, in which case a conditional request with the stored ETag and
+    Last-Modified headers is sent first. Least recently used responses are evicted when
+    the bodies exceed max_size_mb.
+    """
+
+    def __init__(self, path, max_size_mb=1024, revalidate=False):
+        self.path = str(path)
+        self.max_size = max_size_mb * 1024 * 1024
+        self.revalidate = revalidate
+        self.local = threading.local()
+
+    def get(self, url, timeout=30):
+        """Returns the status code and the text of the response."""
+        row = self._connection().execute(
+            "SELECT body, encoding, etag, last_modified FROM responses WHERE url = ?", (url,)).fetchone()
+        if row is not None and not self.revalidate:
+            self._touch(url)
+            return 200, self._decode(row[0], row[1])
+
+        headers = {}
+        if row is not None:
+            if row[2]:
+                headers['If-None-Match'] = row[2]
+            if row[3]:
+                headers['If-Modified-Since'] = row[3]
+        response = self._session().get(url, headers=headers, timeout=timeout)
+        if response.status_code == 304 and row is not None:
+            self._touch(url)
+            return 200, self._decode(row[0], row[1])
+        if response.status_code == 200:
+            self._store(url, response)
+        return response.status_code, response.text
+
+    def _decode(self, body, encoding):
+        return zlib.decompress(body).decode(encoding or 'utf-8', errors='replace')
+
+    def _touch(self, url):
+        with self._connection() as connection:
+            connection.execute("UPDATE responses SET accessed = ? WHERE url = ?", (time.time(), url))
+
+    def _store(self, url, response):
+        body = zlib.compress(response.content)
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (url, body, encoding, etag, last_modified, size, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, body, response.encoding, response.headers.get('ETag'),
+                 response.headers.get('Last-Modified'), len(body), time.time()))
+            self._evict(connection)
+
+    def _evict(self, connection):
+        total_size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total_size <= self.max_size:
+            return
+        # free a tenth of the cache at once, so eviction does not run on every insert
+        to_free = total_size - self.max_size * 0.9
+        freed = 0
+        evicted = []
+        for url, size in connection.execute("SELECT url, size FROM responses ORDER BY accessed"):
+            evicted.append((url,))
+            freed += size
+            if freed >= to_free:
+                break
+        connection.executemany("DELETE FROM responses WHERE url = ?", evicted)
+
+    def _connection(self):
+        # sqlite connections and sessions must not cross threads or forked processes
+        if getattr(self.local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=60)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, body BLOB, encoding TEXT, "
+                "etag TEXT, last_modified TEXT, size INTEGER, accessed REAL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            connection.commit()
+            self.local.connection = connection
+            self.local.session = None
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def _session(self):
+        self._connection()
+        if self.local.session is None:
+            self.local.session = requests.Session()
+        return self.local.session
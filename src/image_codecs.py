@@ -0,0 +1,35 @@
+import io
+
+import cv2
+import numpy as np
+
+
+CODECS = ('png', 'webp', 'jpeg', 'raw')
+EXTENSIONS = {'png': 'png', 'webp': 'webp', 'jpeg': 'jpg', 'raw': 'npy'}
+# png compression level 0-9, webp and jpeg quality 0-100
+DEFAULT_QUALITY = {'png': 6, 'webp': 90, 'jpeg': 95, 'raw': None}
+
+
+def resize_image(image, image_size):
+    """Resizes an (H, W, 3) page to image_size x image_size with area interpolation, as for downscaling."""
+    return cv2.resize(image, (image_size, image_size), interpolation=cv2.INTER_AREA)
+
+
+def encode_image(image, codec='png', quality=None):
+    """Encodes an RGB uint8 array, raw images are saved as .npy with their shape and dtype."""
+    if codec == 'raw':
+        out = io.BytesIO()
+        np.save(out, np.ascontiguousarray(image))
+        return out.getvalue()
+    if codec not in CODECS:
+        raise ValueError(f"Unknown image codec: {codec}")
+    if quality is None:
+        quality = DEFAULT_QUALITY[codec]
+    params = {'png': [cv2.IMWRITE_PNG_COMPRESSION, quality],
+              'webp': [cv2.IMWRITE_WEBP_QUALITY, quality],
+              'jpeg': [cv2.IMWRITE_JPEG_QUALITY, quality]}[codec]
+    # OpenCV encodes BGR images
+    succeeded, data = cv2.imencode(f'.{EXTENSIONS[codec]}', cv2.cvtColor(image, cv2.COLOR_RGB2BGR), params)
+    if not succeeded:
+        raise ValueError(f"Failed to encode an image with {codec}")
+    return data.tobytes()
@@ -1,13 +1,15 @@
-import json
 import multiprocessing
 import os
 from pathlib import Path
+import queue
 import shutil
 import time
 
-from tqdm import tqdm
-
 from src.document_generator import DocumentGenerator
+from src.docx_resources import get_available_fonts, get_color_palette
+from src.manifest import RunManifest
+from src.metrics import MetricsCollector
+from src.sources import open_source
 from src.url_parser import UrlParser
 
 
@@ -23,7 +25,30 @@ class Manager:
                  max_urls,
                  num_processes, 
                  max_threads,
-                 ports):
+                 ports,
+                 single_render=False,
+                 unoservers_per_process=1,
+                 recycle_after=0,
+                 max_retries=2,
+                 streaming=False,
+                 queue_size=None,
+                 crawler_threads=8,
+                 crawl_checkpoint=None,
+                 corpus=None,
+                 http_cache=None,
+                 variants_per_url=1,
+                 html_parser='lxml',
+                 rasterizer='auto',
+                 pages_in_flight=0,
+                 output_format='folder',
+                 shard_size_mb=256,
+                 resume=False,
+                 cpu_workers=0,
+                 codec='png',
+                 quality=None,
+                 writer_threads=2,
+                 metrics_interval=10,
+                 metrics_port=0):
         
         self.docx_config = docx_config
         self.out_dir = out_dir
@@ -36,128 +61,162 @@ class Manager:
         self.num_processes = num_processes
         self.max_threads = max_threads
         self.ports = ports
-
-        self.url_parser = UrlParser()
-        self.folders = self._create_folders(remove_existing_dir=remove_existing_dir)
-        self.doc_generators = [DocumentGenerator(self.max_threads,
-                                                 self.image_size, 
-                                                 self.docx_config, 
-                                                 self.folders[i], 
-                                                 ports[i], 
-                                                 ports[num_processes + i],
-                                                 self.debug,) \
+        self.single_render = single_render
+        self.unoservers_per_process = unoservers_per_process
+        self.recycle_after = recycle_after
+        self.max_retries = max_retries
+        self.streaming = streaming
+        # a bounded queue makes the crawler wait when generators fall behind
+        self.queue_size = queue_size or 2 * num_processes * max_threads
+
+        # warm up per-process caches before forking, so generators inherit them
+        get_available_fonts()
+        get_color_palette()
+
+        self.corpus = corpus
+        self.url_parser = UrlParser(num_fetchers=crawler_threads, checkpoint_path=crawl_checkpoint,
+                                    http_cache=http_cache)
+        if resume and remove_existing_dir:
+            raise ValueError("--resume keeps the output of the previous run, it cannot be combined with --remove_existing_dir")
+        self.resume = resume
+        self._create_out_dir(remove_existing_dir=remove_existing_dir)
+        self.manifest = RunManifest(self.out_dir / "manifest.sqlite")
+        self.metrics_interval = metrics_interval
+        self.metrics_port = metrics_port
+        self.doc_generators = [DocumentGenerator(max_threads=self.max_threads,
+                                                 image_size=self.image_size,
+                                                 docx_config=self.docx_config,
+                                                 out_folder=self.out_dir,
+                                                 ports=self._get_process_ports(i),
+                                                 debug_mode=self.debug,
+                                                 single_render=self.single_render,
+                                                 recycle_after=self.recycle_after,
+                                                 max_retries=self.max_retries,
+                                                 corpus=self.corpus,
+                                                 http_cache=http_cache,
+                                                 variants_per_url=variants_per_url,
+                                                 html_parser=html_parser,
+                                                 rasterizer=rasterizer,
+                                                 pages_in_flight=pages_in_flight,
+                                                 output_format=output_format,
+                                                 shard_size_mb=shard_size_mb,
+                                                 manifest=self.manifest,
+                                                 cpu_workers=cpu_workers,
+                                                 metrics_interval=metrics_interval,
+                                                 codec=codec,
+                                                 quality=quality,
+                                                 writer_threads=writer_threads) \
                                for i in range(num_processes)]
 
     def generate(self):
         start_time = time.time()
-        print('Parsing urls...')
-        urls = self.url_parser.parse(self.start_page, self.max_urls, self.languages)
-        urls_chunks = self._split_urls_to_chunks(urls)
+        url_queue = multiprocessing.Queue(maxsize=self.queue_size)
+        stats_queue = multiprocessing.Queue()
+        metrics_queue = multiprocessing.Queue()
+        metrics_collector = MetricsCollector(metrics_queue, self.out_dir / "metrics.jsonl",
+                                             self.metrics_interval, self.metrics_port)
+        metrics_collector.start()
         processes = []
         
         for i in range(self.num_processes):
             process = multiprocessing.Process(name=f"Generator_{i}", target=self.doc_generators[i].generate, 
-                                              kwargs={"urls": urls_chunks[i]})
+                                              kwargs={"url_queue": url_queue, "stats_queue": stats_queue,
+                                                      "metrics_queue": metrics_queue})
             processes.append(process)
             process.start()
 
+        if self.corpus is not None:
+            # keys of an offline corpus replace crawled urls
+            urls = open_source(self.corpus).keys()[:self.max_urls]
+        elif self.streaming:
+            # generators consume urls while the crawler is still discovering them
+            print('Parsing urls...')
+            urls = self.url_parser.iter_urls(self.start_page, self.max_urls, self.languages)
+        else:
+            print('Parsing urls...')
+            urls = self.url_parser.parse(self.start_page, self.max_urls, self.languages)
+        # urls completed by a previous run are skipped, failed ones are queued again
+        completed = self.manifest.completed_urls() if self.resume else set()
+        num_urls = 0
+        skipped = 0
+        generators_alive = True
+        for url in urls:
+            if url in completed:
+                skipped += 1
+                continue
+            generators_alive = self._put_url(url_queue, url, processes)
+            if not generators_alive:
+                break
+            num_urls += 1
+        if self.resume:
+            print(f'Resuming run, {skipped} completed urls skipped')
+        # one poison pill for every thread of every process
+        for _ in range(self.num_processes * self.max_threads):
+            if not generators_alive:
+                break
+            generators_alive = self._put_url(url_queue, None, processes)
+        if not generators_alive:
+            print('All generator processes exited, stopping the run')
+            # nobody reads the urls left in the queue, the manager must not wait to flush them on exit
+            url_queue.cancel_join_thread()
+
+        # read the stats before joining, a process cannot exit while its queue buffer is not consumed
+        worker_stats = self._collect_worker_stats(processes, stats_queue)
         for process in processes:
             process.join()
+        metrics_collector.stop()
+        self._print_worker_stats(worker_stats)
 
-        self._merge_all_folders()
-        
         end_time = time.time()
-        file_count = 0
-        for root, dirs, files in os.walk(self.out_dir):
-            file_count += len(files)
-        file_count /= 2
+        file_count = sum(stats["images"] for stats in worker_stats)
         print('Images:', int(file_count))
         print('Elapsed time:', end_time - start_time)
-        print('Urls per second:', self.max_urls / (end_time - start_time))
+        print('Urls per second:', num_urls / (end_time - start_time))
         print('Images per second:', file_count / (end_time - start_time))
         print()
-        print('Seconds per url:', (end_time - start_time) / self.max_urls)
-        print('Seconds per image:', (end_time - start_time) / file_count)
-        print('Images per url:', file_count / self.max_urls)
-    
-    def _split_urls_to_chunks(self, urls):
-        n = len(urls)
-        chunk_size = n // self.num_processes
-        remainder = n % self.num_processes
-
-        chunks = []
-        for i in range(self.num_processes):
-            start_index = i * chunk_size + min(i, remainder)
-            end_index = start_index + chunk_size + (1 if i < remainder else 0)
-            chunks.append(urls[start_index:end_index])
-        return chunks
+        print('Seconds per url:', (end_time - start_time) / max(num_urls, 1))
+        print('Seconds per image:', (end_time - start_time) / max(file_count, 1))
+        print('Images per url:', file_count / max(num_urls, 1))
     
-    def _create_folders(self, remove_existing_dir):
-        folders = [self.out_dir / f"tmp_process_{i}" for i in range(self.num_processes)]
-        if remove_existing_dir:
-            if os.path.exists(self.out_dir):
-                shutil.rmtree(self.out_dir)
-            for folder in folders:
-                if os.path.exists(folder):
-                    shutil.rmtree(folder)
-        
-        for folder in folders:
-            os.makedirs(folder)
-
-        return folders
+    def _get_process_ports(self, process_id):
+        # the first half of the ports are Unoserver ports, the second half are their uno ports
+        num_servers = self.num_processes * self.unoservers_per_process
+        if len(self.ports) < 2 * num_servers:
+            raise ValueError(f"{2 * num_servers} ports are required, {len(self.ports)} given")
+        first = process_id * self.unoservers_per_process
+        return [(self.ports[i], self.ports[num_servers + i]) 
+                for i in range(first, first + self.unoservers_per_process)]
+
+    def _put_url(self, url_queue, url, processes):
+        """Waits for room in the bounded queue, returns False if every generator process exited."""
+        while True:
+            try:
+                url_queue.put(url, timeout=1)
+                return True
+            except queue.Full:
+                if not any(process.is_alive() for process in processes):
+                    return False
+
+    def _collect_worker_stats(self, processes, stats_queue):
+        worker_stats = []
+        while len(worker_stats) < len(processes):
+            try:
+                worker_stats.append(stats_queue.get(timeout=1))
+            except queue.Empty:
+                # a crashed process never reports its stats
+                if not any(process.is_alive() for process in processes) and stats_queue.empty():
+                    break
+        return worker_stats
+
+    def _print_worker_stats(self, worker_stats):
+        for stats in sorted(worker_stats, key=lambda stats: stats["name"]):
+            utilization = stats["busy_time"] / max(stats["elapsed"] * stats["threads"], 1e-9)
+            print(f'{stats["name"]}: cpu workers {stats["cpu_workers"]}, urls {stats["urls"]}, failed {stats["failed_urls"]}, '
+                  f'retries {stats["retries"]}, images {stats["images"]}, dropped pages {stats["dropped_pages"]}, '
+                  f'utilization {utilization:.1%}')
     
-    def _validate_annotations(self, image_path, anno_path):
-        if not os.path.exists(image_path):
-            print(f"Image {image_path} not found")
-            return False
-        if not os.path.exists(anno_path):
-            print(f"Annotation {anno_path} not found")
-            return False
-        
-        with open(anno_path, 'r') as f:
-            anno = json.load(f)
-
-        if len(anno['words']) != len(anno['bboxes']):
-            print(f"Annotation {anno_path} has different number of words and bboxes")
-            return False
-
-        return True
-
-    def _merge_all_folders(self):
-        counter = 0
-        bad_annotations = 0
-        for folder_path in tqdm(self.folders):
-            if os.path.isdir(folder_path):
-                # Iterate over each file in the current folder
-                for file_name in sorted([f for f in os.listdir(folder_path) if f.endswith('.png.json')]):
-                    json_path = os.path.join(folder_path, file_name)
-
-                    if self._validate_annotations(json_path[:-5], json_path):
-                        new_file_name = f"image_{counter}.png"   
-                        new_json_name = f"image_{counter}.png.json"
-
-                        new_file_path = os.path.join(self.out_dir, new_file_name)
-                        new_json_path = os.path.join(self.out_dir, new_json_name)
-
-                        # Move and rename the file
-                        shutil.move(json_path[:-5], new_file_path)
-                        shutil.move(json_path, new_json_path)
-                        #print(f'{json_path} -> {new_json_path}')
-                        #print(f'{json_path[:-5]} -> {new_file_path}')
-                        
-                        # Move the colored image
-                        _, number = file_name.split("_")
-                        number = number.split(".")[0]
-                        #print(f'{folder_path}/im_{number}_colored.png -> {new_file_path[:-4] + "_colored.png"}')
-                        #print('--------------------------------')
-                        if os.path.exists(f"{folder_path}/im_{number}_colored.png"):
-                            shutil.move(f"{folder_path}/im_{number}_colored.png", new_file_path[:-4] + "_colored.png")
-
-                        counter += 1
-                    else:
-                        bad_annotations += 1
-        
-        for i in range(self.num_processes):
-            shutil.rmtree(self.out_dir / f'tmp_process_{i}')
-
-        print(f'Folder merge finished, bad annotations: {bad_annotations}')
+    def _create_out_dir(self, remove_existing_dir):
+        # every process writes straight into out_dir, under names that do not collide
+        if remove_existing_dir and os.path.exists(self.out_dir):
+            shutil.rmtree(self.out_dir)
+        os.makedirs(self.out_dir, exist_ok=True)
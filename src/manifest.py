@@ -0,0 +1,46 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class RunManifest:
+    """Append-only SQLite log of processed urls, shared by every thread of every process.
+
+    Each processed url appends a row with its status, the number of images written,
+    the number of attempts and the time spent on it. Rows are never updated, the
+    latest row of a url is its current status, so a resumed run that fails a url
+    again only adds to its history.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.local = threading.local()
+
+    def record(self, url, succeeded, images, attempts, elapsed, worker=None):
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT INTO urls (url, status, images, attempts, elapsed, finished, worker) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, 'done' if succeeded else 'failed', images, attempts, elapsed, time.time(),
+                 worker or threading.current_thread().name))
+
+    def completed_urls(self):
+        """Urls whose latest row is done, failed urls are not included so they are retried."""
+        rows = self._connection().execute(
+            "SELECT url FROM urls WHERE id IN (SELECT MAX(id) FROM urls GROUP BY url) AND status = 'done'")
+        return {url for url, in rows}
+
+    def _connection(self):
+        # sqlite connections must not cross threads or forked processes
+        if getattr(self.local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=60)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS urls (id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT, status TEXT, "
+                "images INTEGER, attempts INTEGER, elapsed REAL, finished REAL, worker TEXT)")
+            connection.execute("CREATE INDEX IF NOT EXISTS urls_url ON urls (url)")
+            connection.commit()
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return self.local.connection
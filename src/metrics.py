@@ -0,0 +1,194 @@
+import bisect
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import queue
+import threading
+import time
+
+
+# upper bounds of the stage duration histograms in seconds, the last bucket is +Inf
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Metrics:
+    """Counters and stage duration histograms of one process, updated by all of its threads.
+
+    An update is a few dictionary operations under a lock, microseconds against the
+    seconds a page takes, so metrics are always collected.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.stages = {}
+
+    def add(self, counter, value=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def observe(self, stage, seconds):
+        bucket = bisect.bisect_left(STAGE_BUCKETS, seconds)
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = {"count": 0, "sum": 0.0, "buckets": [0] * (len(STAGE_BUCKETS) + 1)}
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+            histogram["buckets"][bucket] += 1
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start_time)
+
+    def snapshot(self):
+        with self.lock:
+            return {"counters": dict(self.counters),
+                    "stages": {stage: {**histogram, "buckets": list(histogram["buckets"])}
+                               for stage, histogram in self.stages.items()}}
+
+
+def merge_snapshots(snapshots):
+    merged = {"counters": {}, "stages": {}}
+    for snapshot in snapshots:
+        for counter, value in snapshot["counters"].items():
+            merged["counters"][counter] = merged["counters"].get(counter, 0) + value
+        for stage, histogram in snapshot["stages"].items():
+            total = merged["stages"].setdefault(stage, {"count": 0, "sum": 0.0, "buckets": [0] * (len(STAGE_BUCKETS) + 1)})
+            total["count"] += histogram["count"]
+            total["sum"] += histogram["sum"]
+            total["buckets"] = [a + b for a, b in zip(total["buckets"], histogram["buckets"])]
+    return merged
+
+
+def to_prometheus(snapshot):
+    """Formats a snapshot in the Prometheus text exposition format."""
+    lines = []
+    for counter, value in sorted(snapshot["counters"].items()):
+        lines.append(f'# TYPE doge_{counter}_total counter')
+        lines.append(f'doge_{counter}_total {value}')
+    lines.append('# TYPE doge_stage_seconds histogram')
+    for stage, histogram in sorted(snapshot["stages"].items()):
+        cumulative = 0
+        for bound, count in zip((*STAGE_BUCKETS, '+Inf'), histogram["buckets"]):
+            cumulative += count
+            lines.append(f'doge_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'doge_stage_seconds_sum{{stage="{stage}"}} {histogram["sum"]}')
+        lines.append(f'doge_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsReporter:
+    """Sends the snapshots of a process to the collector of the manager every interval seconds."""
+
+    def __init__(self, metrics, metrics_queue, name, interval):
+        self.metrics = metrics
+        self.metrics_queue = metrics_queue
+        self.name = name
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=f"{name}_metrics", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        # the final snapshot, so the totals of the run are complete
+        self.metrics_queue.put((self.name, self.metrics.snapshot()))
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.metrics_queue.put((self.name, self.metrics.snapshot()))
+
+
+class MetricsCollector:
+    """Aggregates the snapshots of all processes in the manager.
+
+    Snapshots are cumulative, so the latest one of every process is kept. Every interval
+    seconds the totals are appended as a JSON line to jsonl_path, and if port is set they
+    are served in the Prometheus text format at http://localhost:port/metrics.
+    """
+
+    def __init__(self, metrics_queue, jsonl_path, interval=10, port=0):
+        self.metrics_queue = metrics_queue
+        self.jsonl_path = jsonl_path
+        self.interval = interval
+        self.port = port
+        self.latest = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.start_time = time.time()
+        self.thread = threading.Thread(target=self._run, name="MetricsCollector", daemon=True)
+        self.server = None
+
+    def start(self):
+        self.start_time = time.time()
+        self.thread.start()
+        if self.port:
+            collector = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path != '/metrics':
+                        self.send_error(404)
+                        return
+                    body = to_prometheus(collector.totals()).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self.server = ThreadingHTTPServer(('localhost', self.port), Handler)
+            threading.Thread(target=self.server.serve_forever, name="MetricsServer", daemon=True).start()
+            print(f'Serving metrics at http://localhost:{self.port}/metrics')
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self._drain()
+        self._write_line()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def totals(self):
+        with self.lock:
+            return merge_snapshots(self.latest.values())
+
+    def _run(self):
+        next_line = time.time() + self.interval
+        while not self.stopped.is_set():
+            # processes cannot exit before their queued snapshots are read, so the queue is read all the time
+            try:
+                name, snapshot = self.metrics_queue.get(timeout=0.5)
+                with self.lock:
+                    self.latest[name] = snapshot
+            except queue.Empty:
+                pass
+            if time.time() >= next_line:
+                self._write_line()
+                next_line += self.interval
+
+    def _drain(self):
+        while True:
+            try:
+                name, snapshot = self.metrics_queue.get_nowait()
+            except queue.Empty:
+                return
+            with self.lock:
+                self.latest[name] = snapshot
+
+    def _write_line(self):
+        line = {"time": time.time(), "elapsed": time.time() - self.start_time, **self.totals()}
+        with open(self.jsonl_path, 'a') as f:
+            f.write(json.dumps(line) + '\n')
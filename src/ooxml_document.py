@@ -0,0 +1,130 @@
+from collections import namedtuple
+import copy
+import functools
+import io
+import re
+import zipfile
+
+from docx import Document
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls, qn
+from docx.styles.styles import Styles
+from lxml import etree
+
+from src.docx_document import DocxDocument
+
+
+# styles changed by DocxDocument.configure_styles, the rest of styles.xml is static
+CONFIGURED_STYLE_IDS = ('Normal', *(f'Heading{level}' for level in range(1, 10)))
+CUSTOM_STYLES_MARKER = 'custom-styles'
+MARKER_RE = re.compile(r'<!--style:([\w-]+)-->')
+
+OoxmlTemplate = namedtuple('OoxmlTemplate', [
+    'package',          # zip with every part except word/document.xml and word/styles.xml
+    'document_head',    # word/document.xml up to the body content
+    'document_tail',
+    'sect_pr',
+    'styles_chunks',    # static parts of word/styles.xml around the configured styles
+    'styles',           # w:styles with only the configured styles, copied by every document
+    'block_width',
+])
+
+
+@functools.lru_cache(maxsize=None)
+def get_ooxml_template():
+    """Splits the default python-docx package into static bytes and the parts a document changes.
+
+    Built once per process from the same template python-docx uses, so both writers
+    produce the same documents.
+    """
+    doc = Document()
+    section = doc.sections[0]
+    block_width = section.page_width - section.left_margin - section.right_margin
+
+    out = io.BytesIO()
+    doc.save(out)
+    package = io.BytesIO()
+    with zipfile.ZipFile(out) as source, zipfile.ZipFile(package, 'w', zipfile.ZIP_DEFLATED) as target:
+        for name in source.namelist():
+            if name not in ('word/document.xml', 'word/styles.xml'):
+                target.writestr(name, source.read(name))
+
+    body = doc.element.body
+    sect_pr = body.find(qn('w:sectPr'))
+    body.remove(sect_pr)
+    document_head, document_tail = etree.tostring(
+        doc.element, encoding='UTF-8', standalone=True).decode('utf-8').split('<w:body/>')
+
+    styles_element = doc.styles.element
+    styles = parse_xml(f'<w:styles {nsdecls("w")}/>')
+    for style_id in CONFIGURED_STYLE_IDS:
+        style = styles_element.get_by_id(style_id)
+        style.addprevious(etree.Comment(f'style:{style_id}'))
+        styles_element.remove(style)
+        styles.append(style)
+    styles_element.append(etree.Comment(f'style:{CUSTOM_STYLES_MARKER}'))
+    styles_chunks = MARKER_RE.split(etree.tostring(styles_element, encoding='UTF-8', standalone=True).decode('utf-8'))
+
+    return OoxmlTemplate(package.getvalue(), f'{document_head}<w:body>', f'</w:body>{document_tail}',
+                         sect_pr, styles_chunks, styles, block_width)
+
+
+class OoxmlDocument(DocxDocument):
+    """Writes word/document.xml as strings straight from the blocks, without python-docx objects.
+
+    Layout sampling, word runs and rendering are shared with DocxDocument, and the
+    package is the python-docx template with only document.xml and styles.xml
+    written per document.
+    """
+
+    def create_document(self):
+        self.template = get_ooxml_template()
+        self.block_width = self.template.block_width
+        self.colored_body = []
+        self.clean_body = []
+        self.colored = True
+        self.sect_pr = copy.deepcopy(self.template.sect_pr)
+        self.configure_several_columns()
+        self.styles = copy.deepcopy(self.template.styles)
+        self.configure_styles(Styles(self.styles))
+
+    def add_body_xml(self, xml, clean_xml):
+        self.colored_body.append(xml)
+        self.clean_body.append(clean_xml)
+
+    def save_docx(self, path):
+        with open(path, 'wb') as f:
+            f.write(self._get_docx_bytes())
+
+    def _get_docx_bytes(self, body_xml=None):
+        if body_xml is None:
+            body_xml = ''.join(self.colored_body if self.colored else self.clean_body)
+        document_xml = f'{self.template.document_head}{body_xml}{self._serialize(self.sect_pr)}{self.template.document_tail}'
+        out = io.BytesIO(self.template.package)
+        with zipfile.ZipFile(out, 'a', zipfile.ZIP_DEFLATED) as package:
+            package.writestr('word/document.xml', document_xml)
+            package.writestr('word/styles.xml', self._get_styles_xml())
+        return out.getvalue()
+
+    def _get_styles_xml(self):
+        configured = {style.get(qn('w:styleId')): style for style in self.styles}
+        custom = [style for style_id, style in configured.items() if style_id not in CONFIGURED_STYLE_IDS]
+        chunks = list(self.template.styles_chunks)
+        # odd chunks are the names of the markers
+        for i in range(1, len(chunks), 2):
+            if chunks[i] == CUSTOM_STYLES_MARKER:
+                chunks[i] = ''.join(self._serialize(style) for style in custom)
+            else:
+                chunks[i] = self._serialize(configured[chunks[i]])
+        return ''.join(chunks)
+
+
+WRITERS = {'python-docx': DocxDocument, 'ooxml': OoxmlDocument}
+
+
+def create_document(docx_config, uno_client, rasterizer=None, seed=None):
+    """Creates a document with the writer selected by docx_config["writer"], its layout is drawn from seed."""
+    writer = docx_config.get("writer", "python-docx")
+    if writer not in WRITERS:
+        raise ValueError(f"Unknown document writer: {writer}")
+    return WRITERS[writer](docx_config, uno_client, rasterizer, seed)
@@ -0,0 +1,115 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from multiprocessing import shared_memory
+import queue
+import time
+
+import numpy as np
+from PIL import Image
+
+import src.utils as utils
+from src.augmentations import augment
+from src.bbox_extraction import extract_bboxes
+from src.image_codecs import resize_image
+
+
+def process_page(colored_image, image, num_words, seed, image_size, debug_words=None):
+    """Runs the CPU-bound stages of a page: bbox extraction, augmentation and resizing.
+
+    Returns the ids of the words found on the colored page, their augmented bboxes
+    normalized to [0, 1], the final page, the colored page with the boxes drawn if
+    debug_words are given, and the seconds spent in every stage. Pages are RGB arrays,
+    they are encoded by the WriterPool.
+    """
+    start_time = time.perf_counter()
+    ids, bboxes = extract_bboxes(colored_image, num_words)  # bboxes are normalized to [0,1]
+    bbox_time = time.perf_counter()
+    colored_height, colored_width = colored_image.shape[:2]
+    # unnormalize bboxes to augmentation image size
+    bounding_boxes = utils.unnormalize_bboxes(bboxes, colored_width, colored_height)
+
+    # perform augmentation
+    augmented_cv2, _, _, augmented_bounding_boxes = augment(np.array(image), bounding_boxes, seed)
+    augment_time = time.perf_counter()
+    colored_debug_image = None
+    if debug_words is not None:
+        labels = [debug_words[i] for i in ids]
+        augmented_height, augmented_width = augmented_cv2.shape[:2]
+        bboxes_for_image = utils.normalize_bboxes(augmented_bounding_boxes, colored_width, colored_height)
+        bboxes_for_image = utils.unnormalize_bboxes(bboxes_for_image, augmented_width, augmented_height)
+
+        augmented_cv2 = np.asarray(utils.draw_bboxes_pil(Image.fromarray(augmented_cv2), bboxes_for_image, labels))
+        colored_debug_image = np.asarray(utils.draw_bboxes_pil(Image.fromarray(colored_image), bounding_boxes, labels))
+
+    # resize image to final dataset size
+    final_image = resize_image(augmented_cv2, image_size)
+
+    # convert booxes to (x, y, w, h) format and normalize to [0,1]
+    augmented_bounding_boxes = np.array(augmented_bounding_boxes).astype(int)
+    augmented_bounding_boxes = utils.normalize_bboxes(augmented_bounding_boxes, colored_width, colored_height).tolist()
+    stage_seconds = {"bbox": bbox_time - start_time, "augment": augment_time - bbox_time,
+                     "resize": time.perf_counter() - augment_time}
+    return ids, augmented_bounding_boxes, final_image, colored_debug_image, stage_seconds
+
+
+# buffers mapped by a worker process, a worker maps every buffer once
+_attached_buffers = {}
+
+
+def _run_with_buffer(func, buffer_name, specs, args):
+    if buffer_name not in _attached_buffers:
+        _attached_buffers[buffer_name] = shared_memory.SharedMemory(name=buffer_name)
+    buffer = _attached_buffers[buffer_name].buf
+    arrays = [np.ndarray(shape, dtype, buffer=buffer, offset=offset) for shape, dtype, offset in specs]
+    return func(*arrays, *args)
+
+
+class PagePool:
+    """Runs CPU-bound page stages in worker processes, outside of the GIL of the generator threads.
+
+    Pages are copied into one of num_buffers shared memory buffers of buffer_size bytes
+    instead of being pickled, and only the arguments and results that are not arrays
+    travel through pipes. A thread calling run holds a buffer until its page is done,
+    so num_buffers bounds the pages being processed. Workers are spawned, because
+    forking a process with running threads is not safe.
+    """
+
+    def __init__(self, num_workers, num_buffers, buffer_size):
+        self.num_workers = num_workers
+        self.num_buffers = num_buffers
+        self.buffer_size = buffer_size
+        self.executor = None
+        self.buffers = []
+
+    def start(self):
+        self.executor = ProcessPoolExecutor(self.num_workers, mp_context=multiprocessing.get_context('spawn'))
+        self.buffers = [shared_memory.SharedMemory(create=True, size=self.buffer_size) for _ in range(self.num_buffers)]
+        self.free_buffers = queue.SimpleQueue()
+        for buffer in self.buffers:
+            self.free_buffers.put(buffer)
+
+    def stop(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        for buffer in self.buffers:
+            buffer.close()
+            buffer.unlink()
+        self.buffers = []
+
+    def fits(self, arrays):
+        return sum(array.nbytes for array in arrays) <= self.buffer_size
+
+    def run(self, func, arrays, *args):
+        """Calls func(*arrays, *args) in a worker, func must be importable by the workers."""
+        buffer = self.free_buffers.get()
+        try:
+            specs = []
+            offset = 0
+            for array in arrays:
+                np.ndarray(array.shape, array.dtype, buffer=buffer.buf, offset=offset)[...] = array
+                specs.append((array.shape, array.dtype.str, offset))
+                offset += array.nbytes
+            return self.executor.submit(_run_with_buffer, func, buffer.name, specs, args).result()
+        finally:
+            self.free_buffers.put(buffer)
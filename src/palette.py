@@ -0,0 +1,33 @@
+import numpy as np
+
+
+# Every channel takes one of LEVELS values that are multiples of STEP, so the brightest
+# color (188, 188, 188) stays far from white and antialiased blends rarely decode to a word.
+STEP = 4
+LEVELS = 48
+MAX_WORDS = LEVELS ** 3
+
+
+def ids_to_rgb(ids):
+    """Maps word ids to (N, 3) uint8 colors."""
+    ids = np.asarray(ids, dtype=np.int64)
+    if np.any(ids >= MAX_WORDS):
+        raise ValueError(f"Word id exceeds the palette size {MAX_WORDS}")
+    return np.column_stack((ids // LEVELS ** 2, ids // LEVELS % LEVELS, ids % LEVELS)).astype(np.uint8) * STEP
+
+
+def pack_rgb(image):
+    """Packs an (H, W, 3) image into an (H, W) int32 array of 0xRRGGBB codes."""
+    image = np.asarray(image)
+    packed = np.zeros(image.shape[:2] + (4,), dtype=np.uint8)
+    packed[..., :3] = image[..., ::-1]
+    return packed.view('<u4')[..., 0].view(np.int32)
+
+
+def codes_to_ids(codes):
+    """Decodes 0xRRGGBB codes to word ids, -1 for colors outside of the palette."""
+    codes = np.asarray(codes, dtype=np.int32)
+    # every channel must be a multiple of STEP below STEP * LEVELS = 0b11000000
+    valid = ((codes & 0x030303) | ((codes >> 1) & codes & 0x404040)) == 0
+    ids = (codes >> 18) * LEVELS ** 2 + ((codes >> 10) & 0x3F) * LEVELS + ((codes >> 2) & 0x3F)
+    return np.where(valid, ids, -1)
@@ -0,0 +1,90 @@
+import subprocess
+import tempfile
+import threading
+
+import numpy as np
+from pdf2image import convert_from_bytes, pdfinfo_from_bytes
+from PIL import Image
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+
+RASTERIZERS = ('auto', 'pdfium', 'poppler')
+
+# pdfium is not thread-safe, all of its calls in a process are serialized
+_pdfium_lock = threading.Lock()
+
+
+class PdfiumRasterizer:
+    """Renders pages in-process with pdfium, one page at a time, straight into NumPy arrays."""
+
+    def page_texts(self, pdf_bytes):
+        """Returns the text of every page, with whitespace collapsed."""
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(pdf_bytes)
+            try:
+                texts = []
+                for page in pdf:
+                    text_page = page.get_textpage()
+                    texts.append(' '.join(text_page.get_text_range().split()))
+                    text_page.close()
+                    page.close()
+                return texts
+            finally:
+                pdf.close()
+
+    def iter_pages(self, pdf_bytes, dpi, size=None, first_page=1, last_page=None):
+        """Yields (H, W, 3) uint8 RGB pages, scaled so the longer side equals size if it is given."""
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(pdf_bytes)
+            num_pages = len(pdf)
+        try:
+            for index in range(first_page - 1, min(last_page or num_pages, num_pages)):
+                with _pdfium_lock:
+                    page = pdf[index]
+                    scale = size / max(page.get_size()) if size else dpi / 72
+                    # the array is a view of the bitmap buffer, which is owned by python
+                    image = page.render(scale=scale, rev_byteorder=True).to_numpy()
+                    page.close()
+                yield image
+        finally:
+            with _pdfium_lock:
+                pdf.close()
+
+
+class PopplerRasterizer:
+    """Renders pages with pdftoppm through pdf2image.
+
+    All pages of a range are rendered by one subprocess into a temporary folder,
+    and decoded one at a time while they are consumed.
+    """
+
+    def page_texts(self, pdf_bytes):
+        """Returns the text of every page, with whitespace collapsed."""
+        num_pages = pdfinfo_from_bytes(pdf_bytes)["Pages"]
+        output = subprocess.run(['pdftotext', '-q', '-', '-'], input=pdf_bytes, capture_output=True, check=True).stdout
+        # pages are separated by form feeds
+        pages = output.decode('utf-8', errors='replace').split('\f')[:num_pages]
+        return [' '.join(page.split()) for page in pages] + [''] * (num_pages - len(pages))
+
+    def iter_pages(self, pdf_bytes, dpi, size=None, first_page=1, last_page=None):
+        with tempfile.TemporaryDirectory() as folder:
+            paths = convert_from_bytes(pdf_bytes, dpi=dpi, size=size, first_page=first_page, last_page=last_page,
+                                       output_folder=folder, paths_only=True)
+            for path in paths:
+                with Image.open(path) as image:
+                    yield np.asarray(image.convert('RGB'))
+
+
+def get_rasterizer(name='auto'):
+    """pdfium when it is installed and name is auto, poppler otherwise."""
+    if name not in RASTERIZERS:
+        raise ValueError(f"Unknown rasterizer: {name}")
+    if name == 'pdfium' or (name == 'auto' and pdfium is not None):
+        if pdfium is None:
+            raise ImportError("The pdfium rasterizer requires pypdfium2")
+        return PdfiumRasterizer()
+    return PopplerRasterizer()
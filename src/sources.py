@@ -0,0 +1,179 @@
+import gzip
+import json
+import mmap
+import os
+from pathlib import Path
+import shutil
+import tarfile
+import tempfile
+import threading
+import zipfile
+
+import requests
+
+
+# responses telling that the article does not exist, retrying them cannot succeed
+MISSING_STATUS_CODES = (404, 410)
+
+
+class ArticleNotFound(Exception):
+    """The source has no article for the url, unlike failed fetches it is not worth a retry."""
+
+
+class HttpSource:
+    """Downloads article HTML by url, through the response cache if one is given."""
+
+    def __init__(self, http_cache=None):
+        self.http_cache = http_cache
+
+    def keys(self):
+        raise NotImplementedError("Urls of the http source come from the crawler")
+
+    def fetch(self, url):
+        if self.http_cache is not None:
+            status_code, text = self.http_cache.get(url)
+        else:
+            response = requests.get(url)
+            status_code, text = response.status_code, response.text
+        if status_code in MISSING_STATUS_CODES:
+            raise ArticleNotFound(f"{status_code} {url}")
+        if status_code != 200:
+            print(f"Bad Response: {status_code} {url}")
+            return None
+        return text
+
+
+class LocalSource:
+    """Base class of offline corpora.
+
+    Files are opened lazily and reopened in every process, because file offsets of
+    descriptors inherited through fork are shared between processes.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def keys(self):
+        self._ensure_open()
+        return list(self.index)
+
+    def fetch(self, key):
+        self._ensure_open()
+        if key not in self.index:
+            raise ArticleNotFound(f"{key} not found in {self.path}")
+        return self._read(key)
+
+    def _ensure_open(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                self._open()
+                self.pid = os.getpid()
+
+    def _open(self):
+        raise NotImplementedError
+
+    def _read(self, key):
+        raise NotImplementedError
+
+
+class DirectorySource(LocalSource):
+    """*.html files of a directory, keyed by their relative path."""
+
+    def _open(self):
+        self.index = {str(path.relative_to(self.path)): path for path in sorted(self.path.rglob('*.html'))}
+
+    def _read(self, key):
+        with open(self.index[key], 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return ''
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return _decode(mapped[:])
+
+
+class TarSource(LocalSource):
+    """*.html members of an uncompressed tar archive, read with pread at their data offsets."""
+
+    def _open(self):
+        with tarfile.open(self.path, 'r:') as tar:
+            self.index = {member.name: (member.offset_data, member.size)
+                          for member in tar.getmembers() if member.isfile() and member.name.endswith('.html')}
+        self.fd = os.open(self.path, os.O_RDONLY)
+
+    def _read(self, key):
+        offset, size = self.index[key]
+        return _decode(os.pread(self.fd, size, offset))
+
+
+class ZipSource(LocalSource):
+    """*.html members of a zip archive."""
+
+    def _open(self):
+        self.zip = zipfile.ZipFile(self.path)
+        self.index = {name: name for name in self.zip.namelist() if name.endswith('.html')}
+
+    def _read(self, key):
+        return _decode(self.zip.read(key))
+
+
+class JsonlSource(LocalSource):
+    """Records {"url": ..., "html": ...} of a JSONL shard, optionally gzip compressed.
+
+    The shard is memory-mapped and indexed by line offsets in one streaming pass.
+    A compressed shard is first streamed into an unnamed temporary file.
+    """
+
+    def _open(self):
+        if self.path.suffix == '.gz':
+            f = tempfile.TemporaryFile()
+            with gzip.open(self.path, 'rb') as compressed:
+                shutil.copyfileobj(compressed, f)
+            f.flush()
+        else:
+            f = open(self.path, 'rb')
+        with f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+
+        self.index = {}
+        start = 0
+        while start < len(self.data):
+            end = self.data.find(b'\n', start)
+            if end == -1:
+                end = len(self.data)
+            if end > start:
+                self.index[self._read_url(start, end)] = (start, end)
+            start = end + 1
+
+    def _read_url(self, start, end):
+        # the url is the first field written by the pack command, so only the prefix is parsed
+        url_end = self.data.find(b'", "html"', start, end)
+        if url_end != -1:
+            try:
+                return json.loads(self.data[start:url_end + 1] + b'}')["url"]
+            except (ValueError, KeyError):
+                pass
+        return json.loads(self.data[start:end])["url"]
+
+    def _read(self, key):
+        start, end = self.index[key]
+        return json.loads(self.data[start:end])["html"]
+
+
+def _decode(data):
+    return data.decode('utf-8', errors='replace')
+
+
+def open_source(corpus=None, http_cache=None):
+    if corpus is None:
+        return HttpSource(http_cache)
+    path = Path(corpus)
+    if path.is_dir():
+        return DirectorySource(path)
+    if path.suffix == '.zip':
+        return ZipSource(path)
+    if path.suffix == '.tar':
+        return TarSource(path)
+    if path.name.endswith('.jsonl') or path.name.endswith('.jsonl.gz'):
+        return JsonlSource(path)
+    raise ValueError(f"Unsupported corpus format: {corpus}")
@@ -1,45 +1,119 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import json
+import os
 from urllib.parse import urljoin, urlparse
 from bs4 import BeautifulSoup
 import requests
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 
 
 class UrlParser:
+    def __init__(self, num_fetchers=8, checkpoint_path=None, checkpoint_every=100, domain='wikipedia.org',
+                 http_cache=None):
+        self.num_fetchers = num_fetchers
+        self.http_cache = http_cache
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.domain = domain
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=num_fetchers, pool_maxsize=num_fetchers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
     def parse(self, start_url, max_urls, languages):
-        ptr = 0
-        urls = []
-        urls.append(start_url)
+        return list(self.iter_urls(start_url, max_urls, languages))
+
+    def iter_urls(self, start_url, max_urls, languages):
+        """Yields article urls as soon as they are discovered, excluding the start url.
 
-        pbar = tqdm(initial=1, total=max_urls)
-        while len(urls) < max_urls:
-            url = urls[ptr]
+        Pages are fetched by a pool of threads in breadth-first order. If checkpoint_path
+        is set, the discovered urls and the frontier of pages still to fetch are saved
+        there, and a crawl with an existing checkpoint resumes from it.
+        """
+        found, frontier = self._load_checkpoint(start_url)
+        seen = set(found)
+        seen.add(start_url)
+        yield from found[:max_urls - 1]
+
+        pbar = tqdm(initial=min(len(found) + 1, max_urls), total=max_urls)
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=self.num_fetchers, thread_name_prefix="UrlParser") as executor:
             try:
-                response = requests.get(url)
+                while len(found) < max_urls - 1 and (frontier or in_flight):
+                    while frontier and len(in_flight) < self.num_fetchers:
+                        url = frontier.popleft()
+                        in_flight[executor.submit(self.fetch_links, url)] = url
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+
+                    for future in done:
+                        url = in_flight.pop(future)
+                        links = future.result()
+                        if links is None:
+                            continue
+                        for href in links:
+                            full_url = urljoin(url, href)
+                            if len(found) < max_urls - 1 and full_url not in seen and self.is_valid_url(full_url, languages):
+                                seen.add(full_url)
+                                found.append(full_url)
+                                frontier.append(full_url)
+                                pbar.update(1)
+                                if len(found) % self.checkpoint_every == 0:
+                                    self._save_checkpoint(start_url, found, frontier, in_flight.values())
+                                yield full_url
+            finally:
+                # also runs when the consumer stops early
+                self._save_checkpoint(start_url, found, frontier, in_flight.values())
+                for future in in_flight:
+                    future.cancel()
+        pbar.close()
+
+    def fetch_links(self, url):
+        try:
+            if self.http_cache is not None:
+                status_code, html = self.http_cache.get(url)
+                if status_code != 200:
+                    raise requests.exceptions.HTTPError(f"{status_code} for url: {url}")
+            else:
+                response = self.session.get(url, timeout=30)
                 response.raise_for_status()
-            except requests.exceptions.RequestException as e:
-                print(f"Failed to retrieve {url}: {e}")
-                return
-
-            # Parse the page content
-            soup = BeautifulSoup(response.content, 'html.parser')
-
-            # Find all links on the page
-            links = soup.find_all('a', href=True)
-            for link in links:
-                href = link['href']
-                full_url = urljoin(url, href)
-                if self.is_valid_url(full_url, languages) and full_url not in urls and len(urls) < max_urls:
-                    urls.append(full_url)
-                    pbar.update(1)
-            ptr += 1
-        return urls[1:]
-    
+                html = response.content
+        except requests.exceptions.RequestException as e:
+            print(f"Failed to retrieve {url}: {e}")
+            return None
+
+        # Find all links on the page
+        soup = BeautifulSoup(html, 'html.parser')
+        return [link['href'] for link in soup.find_all('a', href=True)]
+
+    def _load_checkpoint(self, start_url):
+        if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+            return [], deque([start_url])
+        with open(self.checkpoint_path, 'r') as f:
+            checkpoint = json.load(f)
+        if checkpoint["start_url"] != start_url:
+            raise ValueError(f"Checkpoint {self.checkpoint_path} belongs to a crawl from {checkpoint['start_url']}")
+        print(f"Resuming crawl with {len(checkpoint['found'])} urls found")
+        return checkpoint["found"], deque(checkpoint["frontier"])
+
+    def _save_checkpoint(self, start_url, found, frontier, in_flight):
+        if self.checkpoint_path is None:
+            return
+        # pages that are being fetched go back to the frontier
+        checkpoint = {"start_url": start_url, "found": found, "frontier": [*in_flight, *frontier]}
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
     def is_valid_url(self, url, languages):
         # Check if the URL is a valid Wikipedia article URL
         parsed = urlparse(url)
-        if parsed.scheme in ('http', 'https') and 'wikipedia.org' in parsed.netloc and \
+        if parsed.scheme in ('http', 'https') and self.domain in parsed.netloc and \
             any(parsed.netloc.find(lang_element) != -1 for lang_element in languages):
             path = parsed.path
             if path.startswith('/wiki/') and not any(sub in path for sub in [':', '/wiki/Main_Page']):
                 return True
-        return False
\ No newline at end of file
+        return False
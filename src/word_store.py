@@ -0,0 +1,24 @@
+from array import array
+
+
+class WordStore:
+    """Words of a document indexed by their sequential id."""
+
+    STYLES = {None: 0, 'b': 1, 'i': 2, 'u': 3}
+
+    def __init__(self):
+        self.words = []
+        self.paragraphs = array('i')
+        self.styles = array('B')
+
+    def add(self, word, paragraph, formatting=None):
+        self.words.append(word)
+        self.paragraphs.append(paragraph)
+        self.styles.append(self.STYLES.get(formatting, 0))
+        return len(self.words) - 1
+
+    def __len__(self):
+        return len(self.words)
+
+    def __getitem__(self, word_id):
+        return self.words[word_id]
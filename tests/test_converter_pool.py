@@ -0,0 +1,55 @@
+import pytest
+
+from src.converter_pool import ConverterPool
+from scripts.stand_in_converter import StandInConverter
+
+
+class CountingConverter(StandInConverter):
+    """Stand-in that counts its starts and crashes on the conversions listed in crash_on."""
+
+    crash_on = ()
+
+    def __init__(self, port=None, uno_port=None):
+        super().__init__(port, uno_port)
+        self.starts = 0
+        self.conversions = 0
+        self.alive = False
+
+    def start(self):
+        self.starts += 1
+        self.alive = True
+
+    def stop(self):
+        self.alive = False
+
+    def is_alive(self):
+        return self.alive
+
+    def convert(self, indata, convert_to):
+        self.conversions += 1
+        if self.conversions in self.crash_on:
+            self.alive = False
+            raise ConnectionError('converter crashed')
+        return b'%PDF'
+
+
+def test_recycles_after_max_conversions():
+    pool = ConverterPool([(None, None)], max_conversions=2, instance_factory=CountingConverter)
+    for _ in range(5):
+        assert pool.convert(b'docx') == b'%PDF'
+    # started once, then recycled after the 2nd and the 4th conversion
+    assert pool.instances[0].starts == 3
+    assert pool.conversions[0] == 1
+
+
+def test_restarts_after_crash():
+    class CrashingConverter(CountingConverter):
+        crash_on = (2,)
+
+    pool = ConverterPool([(None, None)], instance_factory=CrashingConverter)
+    assert pool.convert(b'docx') == b'%PDF'
+    with pytest.raises(ConnectionError):
+        pool.convert(b'docx')
+    assert pool.instances[0].starts == 2
+    assert pool.instances[0].is_alive()
+    assert pool.convert(b'docx') == b'%PDF'
@@ -0,0 +1,72 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+import pytest
+
+from src.url_parser import UrlParser
+
+
+# every article links back to articles found before, so the crawl has to deduplicate them
+PAGES = {
+    '/wiki/Main_Page': ['/wiki/A', '/wiki/B', '/wiki/A', '/wiki/Special:Random', 'https://example.org/wiki/X', '/wiki/C'],
+    '/wiki/A': ['/wiki/B', '/wiki/C', '/wiki/D', '/wiki/Main_Page'],
+    '/wiki/B': ['/wiki/A', '/wiki/E'],
+    '/wiki/C': ['/wiki/F', '/wiki/C'],
+    '/wiki/D': ['/wiki/A'],
+    '/wiki/E': [],
+    '/wiki/F': [],
+}
+
+
+@pytest.fixture
+def site():
+    requested = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requested.append(self.path)
+            if self.path not in PAGES:
+                self.send_error(404)
+                return
+            body = ''.join(f'<a href="{href}">link</a>' for href in PAGES[self.path]).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}', requested
+    server.shutdown()
+    server.server_close()
+
+
+def crawl(root, max_urls, checkpoint_path=None):
+    url_parser = UrlParser(num_fetchers=1, checkpoint_path=checkpoint_path, domain='127.0.0.1')
+    return url_parser.parse(f'{root}/wiki/Main_Page', max_urls, ('127.0.0.1',))
+
+
+def test_crawl_deduplicates_links(site):
+    root, requested = site
+    urls = crawl(root, 100)
+    assert urls == [f'{root}/wiki/{title}' for title in 'ABCDEF']
+    # every page is fetched once
+    assert sorted(requested) == sorted(PAGES)
+
+
+def test_crawl_resumes_from_checkpoint(site, tmp_path):
+    root, requested = site
+    checkpoint_path = tmp_path / 'crawl.json'
+    assert crawl(root, 3, checkpoint_path) == [f'{root}/wiki/A', f'{root}/wiki/B']
+    assert requested == ['/wiki/Main_Page']
+
+    requested.clear()
+    urls = crawl(root, 100, checkpoint_path)
+    assert urls == [f'{root}/wiki/{title}' for title in 'ABCDEF']
+    # the resumed crawl goes on from the frontier instead of the start page
+    assert '/wiki/Main_Page' not in requested